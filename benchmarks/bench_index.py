@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# gcapy by Chord for PSForever
+# bench_index.py - times the record index scan on a synthetic capture
+
+import sys
+import os
+import struct
+import hashlib
+import tempfile
+import argparse
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gcapy import gcap as gcapModule
+from gcapy.gcap import GCAP
+
+def write_capture(filename, count):
+    """
+    Write a capture of count small game records after the metadata record.
+    """
+    body = struct.pack("<BQBB", 1, 5, 1, 0) + b"\x02\x02\x08\x01"
+    record = struct.pack("<BI", 1, len(body)) + body
+    meta = b"\x00\x01a\x00\x01b"
+    header = GCAP.HEADER.pack(b"GCAP", 1, 0, 3, b"g"*16, 0, 1, count + 1)
+
+    with open(filename, "wb") as fp:
+        fp.write(header + hashlib.sha256(header).digest())
+        fp.write(struct.pack("<BI", 0, len(meta)) + meta)
+
+        for i in range(0, count, 1000000):
+            fp.write(record*min(1000000, count - i))
+
+def scan(filename, useNumpy, trace=False):
+    """
+    Build the whole index, returning (seconds, peak traced bytes). Tracing
+    slows the scan down, so only trace when measuring memory.
+    """
+    saved = gcapModule.numpy
+
+    if not useNumpy:
+        gcapModule.numpy = None
+
+    try:
+        gcap = GCAP.load(filename)
+
+        if trace:
+            tracemalloc.start()
+
+        start = time.time()
+        gcap._get_record_index(gcap.record_count() - 1)
+        elapsed = time.time() - start
+        peak = 0
+
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        gcap.close()
+    finally:
+        gcapModule.numpy = saved
+
+    return (elapsed, peak)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the GCAP record index scan')
+    parser.add_argument('-n', '--records', type=int, default=10000000, help='records in the capture (default: 10M)')
+    parser.add_argument('--memory', action='store_true',
+            help='also measure the peak memory of each scan in a second, traced run (Python 3)')
+    parser.add_argument('capture', nargs='?', help='capture to write and reuse (default: a temporary file)')
+    args = parser.parse_args()
+
+    filename = args.capture or tempfile.mktemp(suffix=".gcap")
+
+    try:
+        if not os.path.exists(filename):
+            print("Writing %d records to %s" % (args.records, filename))
+            write_capture(filename, args.records)
+
+        methods = [("pure Python", False)]
+
+        if gcapModule.numpy is not None:
+            methods.append(("NumPy-assisted", True))
+
+        for name, useNumpy in methods:
+            elapsed, peak = scan(filename, useNumpy)
+            line = "%-16s %6.2f s" % (name, elapsed)
+
+            if args.memory and tracemalloc is not None:
+                elapsed, peak = scan(filename, useNumpy, True)
+                line += "  %5.1f B/record peak" % (float(peak) / args.records)
+
+            print(line)
+    finally:
+        if args.capture is None and os.path.exists(filename):
+            os.remove(filename)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+#!/usr/bin/env python
+import sys
+import os
+import re
+import argparse
+import binascii
+import json
+import sqlite3
+from datetime import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .gcap import *
+from .compress import open_capture
+from .packet import Packet
+from .process import output_ascii, output_json
+
+# file name endings of the captures to catalog
+CAPTURE_EXTENSIONS = (".gcap", ".gcapz", ".gcap.gz", ".gcap.bz2", ".gcap.xz")
+
+# errors that skip a capture rather than the whole run. undecodable metadata
+# strings raise UnicodeDecodeError, a ValueError
+CAPTURE_ERRORS = (IOError, GCAPFormatError, GCAPVersionError, ValueError)
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS captures (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    guid TEXT NOT NULL,
+    version TEXT NOT NULL,
+    capture_revision INTEGER NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    duration INTEGER NOT NULL,
+    record_count INTEGER NOT NULL,
+    sha256_hash TEXT NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS captures_guid ON captures (guid);
+CREATE INDEX IF NOT EXISTS captures_start_time ON captures (start_time);
+CREATE INDEX IF NOT EXISTS captures_duration ON captures (duration);
+CREATE TABLE IF NOT EXISTS packet_index (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS packet_records (
+    packet_type INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    records BLOB NOT NULL,
+    PRIMARY KEY (packet_type, id, path)
+);
+CREATE INDEX IF NOT EXISTS packet_records_path ON packet_records (path);
+"""
+
+COLUMNS = ["path", "size", "mtime", "guid", "version", "capture_revision", "start_time",
+        "end_time", "duration", "record_count", "sha256_hash", "title", "description"]
+
+def error(msg):
+    sys.stderr.write("error: " + msg + "\n")
+
+def info(msg):
+    sys.stderr.write(msg + "\n")
+
+def hexstr(data):
+    return binascii.hexlify(data).decode('ascii')
+
+def parse_duration(text):
+    """
+    Parse a duration in seconds, optionally suffixed with s, m, h or d.
+    """
+    units = {"s" : 1, "m" : 60, "h" : 3600, "d" : 86400}
+    scale = 1
+
+    if len(text) and text[-1] in units:
+        scale = units[text[-1]]
+        text = text[:-1]
+
+    try:
+        return float(text) * scale
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid duration " + text)
+
+def open_catalog(filename):
+    db = sqlite3.connect(filename)
+    db.executescript(SCHEMA)
+    db.create_function("REGEXP", 2,
+            lambda pattern, value: value is not None and re.search(pattern, value, re.I) is not None)
+
+    return db
+
+def find_captures(paths):
+    for p in paths:
+        if os.path.isfile(p):
+            yield os.path.abspath(p)
+            continue
+
+        for root, dirs, files in os.walk(p):
+            dirs.sort()
+
+            for f in sorted(files):
+                if f.endswith(CAPTURE_EXTENSIONS):
+                    yield os.path.abspath(os.path.join(root, f))
+
+def catalog_entry(path, st):
+    gcap = open_capture(path)
+
+    try:
+        record = gcap.get_metadata()['record']
+    finally:
+        gcap.close()
+
+    start = record['start_time']
+    end = record['end_time']
+    title = record['title']
+    description = record['description']
+
+    # Python 2 leaves metadata strings undecoded, which sqlite rejects
+    if isinstance(title, bytes):
+        title = title.decode('utf-8')
+        description = description.decode('utf-8')
+
+    return {
+        "path" : path,
+        "size" : st.st_size,
+        "mtime" : st.st_mtime,
+        "guid" : hexstr(record['guid']),
+        "version" : record['version'],
+        "capture_revision" : record['capture_revision'],
+        "start_time" : start,
+        "end_time" : end,
+        "duration" : end - start if end > start else 0,
+        "record_count" : record['record_count'],
+        "sha256_hash" : hexstr(record['sha256_hash']),
+        "title" : title,
+        "description" : description,
+    }
+
+def prune_missing(db, tables, paths, known, seen):
+    """
+    Delete the rows of tables for the known captures under paths that were
+    not seen. Returns the number of captures removed.
+    """
+    roots = [os.path.abspath(p) for p in paths]
+    removed = 0
+
+    for path in known:
+        under = any(path == r or path.startswith(r.rstrip(os.sep) + os.sep) for r in roots)
+
+        if under and path not in seen:
+            for table in tables:
+                db.execute("DELETE FROM %s WHERE path = ?" % table, (path,))
+
+            removed += 1
+
+    return removed
+
+def update(db, paths, prune=True):
+    """
+    Add new or changed captures under paths to the catalog. Captures are
+    only opened when their size or modification time changed. With prune,
+    entries under paths that no longer exist are removed.
+    """
+    known = dict((row[0], (row[1], row[2])) for row in
+            db.execute("SELECT path, size, mtime FROM captures"))
+    seen = set()
+    added = 0
+    failed = 0
+
+    for path in find_captures(paths):
+        seen.add(path)
+        st = os.stat(path)
+
+        if known.get(path) == (st.st_size, st.st_mtime):
+            continue
+
+        try:
+            entry = catalog_entry(path, st)
+        except CAPTURE_ERRORS as e:
+            error("could not catalog %s: %s" % (path, str(e)))
+            failed += 1
+            continue
+
+        db.execute("INSERT OR REPLACE INTO captures (%s) VALUES (%s)" %
+                (", ".join(COLUMNS), ", ".join(["?"]*len(COLUMNS))),
+                [entry[c] for c in COLUMNS])
+        added += 1
+
+    removed = prune_missing(db, ("captures",), paths, known, seen) if prune else 0
+
+    db.commit()
+
+    return (added, removed, failed)
+
+def query(db, title=None, description=None, guid=None, min_duration=None, max_duration=None):
+    where = []
+    args = []
+
+    if title is not None:
+        where += ["title REGEXP ?"]
+        args += [title]
+    if description is not None:
+        where += ["description REGEXP ?"]
+        args += [description]
+    if guid is not None:
+        where += ["guid = ?"]
+        args += [guid.lower()]
+    if min_duration is not None:
+        where += ["duration >= ?"]
+        args += [min_duration]
+    if max_duration is not None:
+        where += ["duration <= ?"]
+        args += [max_duration]
+
+    sql = "SELECT %s FROM captures" % ", ".join(COLUMNS)
+
+    if len(where):
+        sql += " WHERE " + " AND ".join(where)
+
+    sql += " ORDER BY start_time, path"
+
+    for row in db.execute(sql, args):
+        yield dict(zip(COLUMNS, row))
+
+def encode_postings(numbers):
+    """
+    Encode increasing record numbers as variable length deltas.
+    """
+    out = bytearray()
+    last = 0
+
+    for n in numbers:
+        delta = n - last
+        last = n
+
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+
+        out.append(delta)
+
+    return bytes(out)
+
+def decode_postings(data):
+    numbers = []
+    last = 0
+    delta = 0
+    shift = 0
+
+    for b in bytearray(data):
+        delta |= (b & 0x7f) << shift
+
+        if b & 0x80:
+            shift += 7
+        else:
+            last += delta
+            numbers.append(last)
+            delta = 0
+            shift = 0
+
+    return numbers
+
+def packet_postings(gcap):
+    """
+    Return the sorted numbers of the records carrying each packet, keyed by
+    (PacketType value, id). Bundled packets are unrolled in either
+    direction, as PacketFilter does.
+    """
+    if numpy is not None and isinstance(gcap, GCAP):
+        columns = gcap.to_columns()
+        data = numpy.frombuffer(gcap.mmfile, dtype=numpy.uint8)
+
+        rows, offsets, lengths = Packet.unroll_columns(data, columns['payload_offset'], columns['payload_length'])
+        ptype, pid, unknown = Packet.classify_columns(data, offsets, lengths)
+
+        valid = ptype >= 0
+        code = ptype[valid].astype(numpy.int64)*256 + pid[valid]
+        number = columns['number'][rows[valid]].astype(numpy.int64)
+
+        # unique (packet, record) pairs, ordered by packet then record
+        pairs = numpy.sort(code*(1 << 40) + number)
+        first = numpy.ones(len(pairs), dtype=bool)
+        first[1:] = pairs[1:] != pairs[:-1]
+        pairs = pairs[first]
+        codes = pairs >> 40
+        numbers = pairs & ((1 << 40) - 1)
+        bounds = numpy.flatnonzero(numpy.diff(codes)) + 1
+
+        return dict(((int(c[0]) >> 8, int(c[0]) & 0xff), n.tolist()) for c, n in
+                zip(numpy.split(codes, bounds), numpy.split(numbers, bounds)) if len(c))
+
+    postings = {}
+
+    for number, timestamp, dst, raw in gcap.iter_packets():
+        for p in Packet.unroll(raw):
+            ptype, pid, unknown, _ = Packet.get_type(p)
+
+            if ptype is None:
+                continue
+
+            records = postings.setdefault((ptype.value, pid), [])
+
+            if not len(records) or records[-1] != number:
+                records.append(number)
+
+    return postings
+
+def index_packets(db, paths, prune=True):
+    """
+    Index the records carrying each packet for new or changed captures
+    under paths, like update does for metadata.
+    """
+    known = dict((row[0], (row[1], row[2])) for row in
+            db.execute("SELECT path, size, mtime FROM packet_index"))
+    seen = set()
+    added = 0
+    failed = 0
+
+    for path in find_captures(paths):
+        seen.add(path)
+        st = os.stat(path)
+
+        if known.get(path) == (st.st_size, st.st_mtime):
+            continue
+
+        try:
+            gcap = open_capture(path, zero_copy=True)
+
+            try:
+                postings = packet_postings(gcap)
+            finally:
+                gcap.close()
+        except CAPTURE_ERRORS as e:
+            error("could not index %s: %s" % (path, str(e)))
+            failed += 1
+            continue
+
+        db.execute("DELETE FROM packet_records WHERE path = ?", (path,))
+        db.executemany("INSERT INTO packet_records (packet_type, id, path, count, records) VALUES (?, ?, ?, ?, ?)",
+                [(ptype, pid, path, len(numbers), sqlite3.Binary(encode_postings(numbers)))
+                    for (ptype, pid), numbers in sorted(postings.items())])
+        db.execute("INSERT OR REPLACE INTO packet_index (path, size, mtime) VALUES (?, ?, ?)",
+                (path, st.st_size, st.st_mtime))
+        added += 1
+
+    removed = prune_missing(db, ("packet_records", "packet_index"), paths, known, seen) if prune else 0
+
+    db.commit()
+
+    return (added, removed, failed)
+
+def find_packets(db, names):
+    """
+    Yield (path, records) for every indexed capture with records carrying
+    any of the packet names, where records is a sorted list of record
+    numbers.
+    """
+    found = {}
+
+    for name in names:
+        ptype, pid = Packet.get_id_by_name(name)
+
+        for path, records in db.execute("SELECT path, records FROM packet_records "
+                "WHERE packet_type = ? AND id = ?", (ptype.value, pid)):
+            found.setdefault(path, set()).update(decode_postings(records))
+
+    for path in sorted(found):
+        yield (path, sorted(found[path]))
+
+def show_records(path, records, output_process):
+    try:
+        gcap = open_capture(path)
+    except CAPTURE_ERRORS as e:
+        error("could not open %s: %s" % (path, str(e)))
+        return
+
+    try:
+        if hasattr(gcap, 'get_record'):
+            for r in records:
+                output_process(gcap.get_record(r))
+        else:
+            # compressed streams only read forward, through the sorted records
+            for r in records:
+                for rec in gcap.iter_records(r, r):
+                    output_process(rec.to_dict())
+    finally:
+        gcap.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Catalog GCAP file metadata for fast queries')
+    parser.add_argument('catalog', help='SQLite catalog file')
+    commands = parser.add_subparsers(dest='command')
+
+    updateParser = commands.add_parser('update', help='add new and changed captures to the catalog')
+    updateParser.add_argument('--keep', action='store_true', help='keep entries for deleted captures')
+    updateParser.add_argument('paths', nargs='+', metavar='paths', help='GCAP files or directories')
+
+    queryParser = commands.add_parser('query', help='list cataloged captures')
+    queryParser.add_argument('--title', help='title regular expression (case insensitive)')
+    queryParser.add_argument('--description', help='description regular expression (case insensitive)')
+    queryParser.add_argument('--guid', help='capture GUID')
+    queryParser.add_argument('--longer', type=parse_duration, metavar='DURATION',
+            help='minimum capture length, such as 90m or 2h')
+    queryParser.add_argument('--shorter', type=parse_duration, metavar='DURATION',
+            help='maximum capture length')
+    queryParser.add_argument('-j', '--json', action='store_true', help='JSON output, one capture per line')
+
+    indexParser = commands.add_parser('index', help='index the records carrying each packet')
+    indexParser.add_argument('--keep', action='store_true', help='keep entries for deleted captures')
+    indexParser.add_argument('paths', nargs='+', metavar='paths', help='GCAP files or directories')
+
+    findParser = commands.add_parser('find', help='find the records carrying packets in indexed captures')
+    findParser.add_argument('packets', nargs='+', metavar='packets', help='packet names, such as HitMessage')
+    findParser.add_argument('--records', action='store_true', help='list the matching record numbers')
+    findParser.add_argument('--show', type=int, default=0, metavar='N',
+            help='display the first N matching records of each capture')
+    findParser.add_argument('-j', '--json', action='store_true', help='JSON output, one capture or record per line')
+
+    args = parser.parse_args()
+
+    if args.command is None:
+        parser.error("no command given")
+
+    db = open_catalog(args.catalog)
+
+    if args.command == 'update':
+        start = datetime.now()
+        added, removed, failed = update(db, args.paths, not args.keep)
+
+        info("Cataloged %d captures, removed %d, %d failed (%s)" %
+                (added, removed, failed, str(datetime.now() - start)))
+    elif args.command == 'query':
+        for c in query(db, args.title, args.description, args.guid, args.longer, args.shorter):
+            if args.json:
+                print(json.dumps(c))
+            else:
+                print("%s (records %d, %ds, GUID %s) \"%s\"" % (c['path'], c['record_count'],
+                    c['duration'], c['guid'], c['title']))
+    elif args.command == 'index':
+        start = datetime.now()
+        added, removed, failed = index_packets(db, args.paths, not args.keep)
+
+        info("Indexed %d captures, removed %d, %d failed (%s)" %
+                (added, removed, failed, str(datetime.now() - start)))
+    elif args.command == 'find':
+        try:
+            results = list(find_packets(db, args.packets))
+        except ValueError as e:
+            db.close()
+            parser.error(str(e))
+
+        for path, records in results:
+            if args.json:
+                entry = {"path" : path, "count" : len(records)}
+
+                if args.records:
+                    entry["records"] = records
+
+                print(json.dumps(entry))
+            else:
+                print("%s (%d records)" % (path, len(records)))
+
+                if args.records:
+                    print(" " + " ".join(str(r) for r in records))
+
+            if args.show > 0:
+                show_records(path, records[:args.show], output_json if args.json else output_ascii)
+
+    db.close()
+
+if __name__ == "__main__":
+    main()
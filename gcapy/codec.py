@@ -0,0 +1,365 @@
+# gcapy by Chord for PSForever
+# codec.py - implements declarative bit level decoding of packet fields
+
+import sys
+from binascii import hexlify
+
+from .packet import Packet, PacketType
+from .gcap import GameRecordDestination
+
+class CodecError(Exception):
+    pass
+
+class BitReader(object):
+    """
+    Reads bit fields from a packet, most significant bit first.
+    """
+    __slots__ = ("data", "value", "size")
+
+    def __init__(self, data):
+        self.data = bytes(data)
+        self.size = len(self.data)*8
+
+        if sys.version_info[0] < 3:
+            self.value = int(hexlify(self.data), 16) if len(self.data) else 0
+        else:
+            self.value = int.from_bytes(self.data, 'big')
+
+    def bits(self, position, count):
+        if position + count > self.size:
+            raise CodecError("packet too short for %d bits at bit %d" % (count, position))
+
+        return (self.value >> (self.size - position - count)) & ((1 << count) - 1)
+
+    def bytes(self, position, count):
+        if position % 8 == 0:
+            if position + count*8 > self.size:
+                raise CodecError("packet too short for %d bytes at bit %d" % (count, position))
+
+            return self.data[position//8:position//8+count]
+
+        value = self.bits(position, count*8)
+
+        return bytes(bytearray((value >> (8*(count-1-i))) & 0xff for i in range(count)))
+
+# field types. read returns the value and the position after it. bits is
+# the size of the field, or None when it depends on the packet
+
+class Field(object):
+    bits = None
+
+    def read(self, reader, position, message):
+        raise NotImplementedError()
+
+class UInt(Field):
+    """
+    An unsigned big endian integer.
+    """
+    def __init__(self, bits):
+        self.bits = bits
+
+    def read(self, reader, position, message):
+        return (reader.bits(position, self.bits), position + self.bits)
+
+class UIntL(Field):
+    """
+    An unsigned little endian integer. When bits is not a whole number of
+    bytes, the trailing partial byte holds the most significant bits.
+    """
+    def __init__(self, bits):
+        self.bits = bits
+
+    def read(self, reader, position, message):
+        raw = reader.bits(position, self.bits)
+        partial = self.bits % 8
+        value = raw & ((1 << partial) - 1)
+
+        raw >>= partial
+
+        for i in range(self.bits // 8):
+            value = (value << 8) | (raw & 0xff)
+            raw >>= 8
+
+        return (value, position + self.bits)
+
+class Bool(Field):
+    bits = 1
+
+    def read(self, reader, position, message):
+        return (reader.bits(position, 1) == 1, position + 1)
+
+class QFloat(Field):
+    """
+    A float quantized to a little endian integer of bits bits spanning
+    minimum to maximum.
+    """
+    def __init__(self, minimum, maximum, bits):
+        self.minimum = minimum
+        self.scale = (maximum - minimum) / float((1 << bits) - 1)
+        self.integer = UIntL(bits)
+        self.bits = bits
+
+    def read(self, reader, position, message):
+        value, position = self.integer.read(reader, position, message)
+
+        return (self.minimum + value*self.scale, position)
+
+class Vector(Field):
+    """
+    Fields read one after another into a tuple.
+    """
+    def __init__(self, *fields):
+        self.fields = fields
+
+        if all(f.bits is not None for f in fields):
+            self.bits = sum(f.bits for f in fields)
+
+    def read(self, reader, position, message):
+        values = []
+
+        for f in self.fields:
+            value, position = f.read(reader, position, message)
+            values.append(value)
+
+        return (tuple(values), position)
+
+class Optional(Field):
+    """
+    A field preceded by a bit telling whether it is present. Absent fields
+    read as None.
+    """
+    def __init__(self, field):
+        self.field = field
+
+    def read(self, reader, position, message):
+        if reader.bits(position, 1):
+            return self.field.read(reader, position + 1, message)
+
+        return (None, position + 1)
+
+class Choice(Field):
+    """
+    One of two fields, chosen by the value of an earlier boolean field.
+    """
+    def __init__(self, flag, whenTrue, whenFalse):
+        self.flag = flag
+        self.whenTrue = whenTrue
+        self.whenFalse = whenFalse
+
+    def read(self, reader, position, message):
+        field = self.whenTrue if message[self.flag] else self.whenFalse
+
+        return field.read(reader, position, message)
+
+class String(Field):
+    """
+    A string preceded by its length in characters. Lengths below 128 take
+    a set bit and 7 bits, others a clear bit and 15 bits. pad bits follow
+    the length to align the characters. Wide strings are UTF-16.
+    """
+    def __init__(self, pad=0, wide=False):
+        self.pad = pad
+        self.wide = wide
+
+    def read(self, reader, position, message):
+        if reader.bits(position, 1):
+            size = reader.bits(position + 1, 7)
+            position += 8
+        else:
+            size = reader.bits(position + 1, 15)
+            position += 16
+
+        position += self.pad
+        count = size*2 if self.wide else size
+        data = reader.bytes(position, count)
+
+        return (data.decode('utf-16-le' if self.wide else 'latin-1', 'replace'), position + count*8)
+
+class MessageCodec(object):
+    """
+    Decodes a packet from a list of (name, field). Fields at a fixed bit
+    position are read directly; the others are found by reading the fields
+    before them once.
+    """
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.names = [n for n, f in fields]
+        self.index = dict((n, i) for i, n in enumerate(self.names))
+        self.ptype, self.id = _find_packet(name)
+
+        # packet payload starts after the opcode
+        position = 16 if self.ptype == PacketType.Control else 8
+
+        # decoding plan: fixed start of each field, or None
+        self.starts = []
+
+        for n, f in fields:
+            self.starts.append(position)
+
+            if position is not None and f.bits is not None:
+                position += f.bits
+            else:
+                position = None
+
+    def decode(self, data):
+        return Message(self, BitReader(data))
+
+class Message(object):
+    """
+    A decoded packet. Fields are decoded when first accessed, by name as
+    items or attributes.
+    """
+    __slots__ = ("codec", "reader", "values", "starts")
+
+    def __init__(self, codec, reader):
+        self.codec = codec
+        self.reader = reader
+        self.values = {}
+        self.starts = list(codec.starts)
+
+    @property
+    def name(self):
+        return self.codec.name
+
+    def __getitem__(self, name):
+        if name in self.values:
+            return self.values[name]
+
+        which = self.codec.index[name]
+
+        # continue from the last field with a known start
+        first = which
+
+        while self.starts[first] is None:
+            first -= 1
+
+        for i in range(first, which + 1):
+            fieldName, field = self.codec.fields[i]
+
+            if fieldName in self.values:
+                continue
+
+            value, end = field.read(self.reader, self.starts[i], self)
+            self.values[fieldName] = value
+
+            if i + 1 < len(self.starts):
+                self.starts[i+1] = end
+
+        return self.values[name]
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def to_dict(self):
+        return dict((n, self[n]) for n in self.codec.names)
+
+def _find_packet(name):
+    try:
+        return Packet.get_id_by_name(name)
+    except ValueError as e:
+        raise CodecError(str(e))
+
+# message codecs by (PacketType, id) and by name
+MESSAGES = {}
+MESSAGES_BY_NAME = {}
+
+def message(name, fields):
+    """
+    Define and register the codec of the packet name.
+    """
+    codec = MessageCodec(name, fields)
+
+    MESSAGES[(codec.ptype, codec.id)] = codec
+    MESSAGES_BY_NAME[name] = codec
+
+    return codec
+
+def get_codec(name):
+    if name not in MESSAGES_BY_NAME:
+        raise CodecError("no codec for " + name)
+
+    return MESSAGES_BY_NAME[name]
+
+def decode(data):
+    """
+    Decode a single (unrolled) packet. Returns None for packets without a
+    codec.
+    """
+    ptype, pid, unknown, _ = Packet.get_type(data)
+    codec = MESSAGES.get((ptype, pid))
+
+    return codec.decode(data) if codec is not None else None
+
+def iter_messages(gcap, names=None):
+    """
+    Yield (number, timestamp, destination, message) for every packet of a
+    capture with a codec, or only those of the packet names given.
+    Server bound packets are unrolled first.
+    """
+    wanted = None
+
+    if names is not None:
+        wanted = set((c.ptype, c.id) for c in (get_codec(n) for n in names))
+
+    for number, timestamp, dst, raw in gcap.iter_packets():
+        packets = Packet.unroll(raw) if dst == GameRecordDestination.SERVER else [raw]
+
+        for p in packets:
+            ptype, pid, unknown, _ = Packet.get_type(p)
+
+            if wanted is not None and (ptype, pid) not in wanted:
+                continue
+
+            codec = MESSAGES.get((ptype, pid))
+
+            if codec is not None:
+                yield (number, timestamp, dst, codec.decode(p))
+
+# common field types
+GUID = UIntL(16)
+POSITION = Vector(QFloat(0.0, 8192.0, 20), QFloat(0.0, 8192.0, 20), QFloat(0.0, 1024.0, 16))
+VELOCITY = Vector(QFloat(-256.0, 256.0, 14), QFloat(-256.0, 256.0, 14), QFloat(-256.0, 256.0, 14))
+ANGLE = QFloat(0.0, 360.0, 8)
+
+message("PlayerStateMessage", [
+    ("guid", GUID),
+    ("pos", POSITION),
+    ("vel", Optional(VELOCITY)),
+    ("facing_yaw", ANGLE),
+    ("facing_pitch", ANGLE),
+    ("facing_yaw_upper", ANGLE),
+    ("seq_time", UIntL(10)),
+])
+
+message("PlayerStateMessageUpstream", [
+    ("avatar_guid", GUID),
+    ("pos", POSITION),
+    ("vel", Optional(VELOCITY)),
+    ("facing_yaw", ANGLE),
+    ("facing_pitch", ANGLE),
+    ("facing_yaw_upper", ANGLE),
+    ("seq_time", UIntL(10)),
+    ("unk1", UIntL(3)),
+    ("is_crouching", Bool()),
+    ("is_jumping", Bool()),
+    ("jump_thrust", Bool()),
+    ("is_cloaked", Bool()),
+    ("unk2", UIntL(8)),
+    ("unk3", UIntL(8)),
+])
+
+message("ChatMsg", [
+    ("message_type", UIntL(8)),
+    ("wide_contents", Bool()),
+    ("recipient", String(pad=7, wide=True)),
+    ("contents", Choice("wide_contents", String(wide=True), String())),
+])
+
+message("HitHint", [
+    ("source_guid", GUID),
+    ("player_guid", GUID),
+])
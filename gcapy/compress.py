@@ -0,0 +1,257 @@
+# gcapy by Chord for PSForever
+# compress.py - implements compressed GCAP captures
+
+import bz2
+import gzip
+import os
+import struct
+import sys
+import zlib
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from .gcap import *
+from .stream import GCAPStream
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# codec id, compress, decompress
+CODECS = OrderedDict([
+    ("zlib", (0, lambda data: zlib.compress(data, 6), zlib.decompress)),
+    ("bz2", (1, bz2.compress, bz2.decompress)),
+])
+
+if lzma is not None:
+    CODECS["lzma"] = (2, lzma.compress, lzma.decompress)
+
+GZIP_MAGIC = b'\x1f\x8b'
+BZ2_MAGIC = b'BZh'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+
+class GCAPBlockFile(object):
+    """
+    Reads a block compressed capture written by compress_capture. Records
+    are grouped into independently compressed blocks of whole records, so
+    reading a record only decompresses the block holding it.
+
+    The file is laid out as
+
+      magic, version, codec, block size, GCAP header
+      compressed blocks
+      block table of (first record, offset, compressed size, size)
+      table offset, block count, magic
+    """
+    MAGIC = b'GCZB'
+    VERSION = 1
+    HEAD = struct.Struct("<4sBBI")
+    BLOCK = struct.Struct("<QQII")
+    FOOTER = struct.Struct("<QQ4s")
+    HEAD_LEN = HEAD.size + GCAP.HEADER_LEN
+
+    # decompressed blocks kept for nearby records
+    BLOCK_CACHE = 8
+
+    @staticmethod
+    def load(filename):
+        return GCAPBlockFile(open(filename, 'rb'))
+
+    def __init__(self, fp):
+        self.fp = fp
+
+        magic, version, codec, self.blockSize = GCAPBlockFile.HEAD.unpack(fp.read(GCAPBlockFile.HEAD.size))
+
+        if magic != GCAPBlockFile.MAGIC:
+            raise GCAPFormatError("invalid block file magic bytes")
+
+        if version != GCAPBlockFile.VERSION:
+            raise GCAPVersionError("unsupported block file version %d" % version)
+
+        for name, (codecId, compress, decompress) in CODECS.items():
+            if codecId == codec:
+                self.codec = name
+                self.decompress = decompress
+                break
+        else:
+            raise GCAPFormatError("unsupported block codec %d" % codec)
+
+        self.header = GCAP._check_header(fp.read(GCAP.HEADER_LEN))
+
+        if self.header['version_major'] != 1 or self.header['version_minor'] != 0:
+            raise GCAPVersionError("unsupported version %d.%d" %
+                    (self.header['version_major'], self.header['version_minor']))
+
+        fp.seek(-GCAPBlockFile.FOOTER.size, os.SEEK_END)
+        tableOffset, blockCount, magic = GCAPBlockFile.FOOTER.unpack(fp.read(GCAPBlockFile.FOOTER.size))
+
+        if magic != GCAPBlockFile.MAGIC:
+            raise GCAPFormatError("block file is truncated")
+
+        fp.seek(tableOffset)
+        table = fp.read(blockCount*GCAPBlockFile.BLOCK.size)
+
+        self.blockRecords = array(OFFSET_TYPECODE)
+        self.blockOffsets = array(OFFSET_TYPECODE)
+        self.blockSizes = array('I')
+
+        for i in range(blockCount):
+            firstRecord, offset, compressedSize, size = GCAPBlockFile.BLOCK.unpack_from(table, i*GCAPBlockFile.BLOCK.size)
+
+            self.blockRecords.append(firstRecord)
+            self.blockOffsets.append(offset)
+            self.blockSizes.append(compressedSize)
+
+        self.blocks = OrderedDict()
+
+    def _get_block(self, which):
+        """
+        Return a decompressed block and the offsets of its record headers.
+        """
+        if which in self.blocks:
+            block = self.blocks.pop(which)
+        else:
+            self.fp.seek(self.blockOffsets[which])
+            data = self.decompress(self.fp.read(self.blockSizes[which]))
+
+            links = array('I')
+            position = 0
+
+            while position < len(data):
+                links.append(position)
+                position += 5 + RECORD_LINK.unpack_from(data, position)[1]
+
+            # records are decoded from views over the block. Python 2 slices
+            # the string instead, as its memoryview slices don't convert to bytes
+            block = (memoryview(data) if sys.version_info[0] >= 3 else data, links)
+
+            if len(self.blocks) >= GCAPBlockFile.BLOCK_CACHE:
+                self.blocks.popitem(last=False)
+
+        self.blocks[which] = block
+
+        return block
+
+    def record_count(self):
+        return self.header['record_count']
+
+    def read_record(self, which):
+        if which < 0 or which >= self.record_count():
+            raise IndexError("invalid record index")
+
+        blockNum = bisect_right(self.blockRecords, which) - 1
+        data, links = self._get_block(blockNum)
+        position = links[which - self.blockRecords[blockNum]]
+        recType, recordSize = RECORD_LINK.unpack_from(data, position)
+
+        return GCAP._decode_record(which, recType, data[position+5:position+5+recordSize])
+
+    def get_record(self, which):
+        return self.read_record(which).to_dict()
+
+    def get_metadata(self):
+        if self.record_count() > 0:
+            metaRecord = self.read_record(0)
+
+            if metaRecord.type == RecordType.METADATA:
+                return GCAP._metadata_dict(self.header, metaRecord)
+
+        raise GCAPFormatError("all GCAP files must have a metadata record as the first record")
+
+    def iter_records(self):
+        for i in range(self.record_count()):
+            yield self.read_record(i)
+
+    def iter_packets(self):
+        for rec in self.iter_records():
+            if rec.type == RecordType.GAME:
+                yield (rec.number, rec.timestamp, rec.destination, rec.payload)
+
+    def __iter__(self):
+        for i in range(self.record_count()):
+            yield self.get_record(i)
+
+    def close(self):
+        self.blocks.clear()
+        self.fp.close()
+
+def compress_capture(filename, output, codec="zlib", block_size=1 << 20):
+    """
+    Write the capture filename as a block compressed capture to output.
+    Each block holds whole records and at least block_size bytes of them,
+    unless it is the last block or a single record is larger.
+    """
+    if codec not in CODECS:
+        raise ValueError("unsupported codec " + codec)
+
+    codecId, compress, decompress = CODECS[codec]
+    gcap = GCAP.load(filename)
+
+    try:
+        count = gcap.record_count()
+
+        if count > 0:
+            gcap._get_record_index(count-1)
+
+        # record header offsets, in file order
+        starts = gcap.indexStarts
+        end = starts[-1] + gcap.indexSizes[-1] if count > 0 else GCAP.HEADER_LEN
+
+        table = []
+
+        with open(output, 'wb') as fp:
+            fp.write(GCAPBlockFile.HEAD.pack(GCAPBlockFile.MAGIC, GCAPBlockFile.VERSION,
+                codecId, block_size))
+            fp.write(gcap.mmfile[0:GCAP.HEADER_LEN])
+
+            first = 0
+
+            while first < count:
+                blockStart = starts[first] - 5
+
+                # first record starting at or beyond the block size
+                last = max(bisect_left(starts, blockStart + block_size + 5, first), first+1)
+                blockEnd = starts[last] - 5 if last < count else end
+
+                data = compress(gcap.mmfile[blockStart:blockEnd])
+                table.append(GCAPBlockFile.BLOCK.pack(first, fp.tell(), len(data), blockEnd - blockStart))
+                fp.write(data)
+
+                first = last
+
+            tableOffset = fp.tell()
+            fp.write(b"".join(table))
+            fp.write(GCAPBlockFile.FOOTER.pack(tableOffset, len(table), GCAPBlockFile.MAGIC))
+    finally:
+        gcap.close()
+
+def open_capture(filename, index=None, zero_copy=False):
+    """
+    Open a capture of any supported kind. Plain captures are memory mapped
+    (see GCAP.load), block compressed captures support random access, and
+    gzip, bz2 and xz compressed captures are streamed.
+    """
+    if filename == "-":
+        return GCAPStream.open(filename)
+
+    with open(filename, 'rb') as fp:
+        magic = fp.read(6)
+
+    if magic.startswith(GCAPBlockFile.MAGIC):
+        return GCAPBlockFile.load(filename)
+    elif magic.startswith(GZIP_MAGIC):
+        fp = gzip.open(filename, 'rb')
+    elif magic.startswith(BZ2_MAGIC):
+        fp = bz2.BZ2File(filename, 'rb')
+    elif magic.startswith(XZ_MAGIC) and lzma is not None:
+        fp = lzma.open(filename, 'rb')
+    else:
+        return GCAP.load(filename, index, zero_copy)
+
+    stream = GCAPStream(fp)
+    stream.owned = True
+
+    return stream
@@ -7,12 +7,49 @@ import mmap
 import os
 import json
 import sys
+import time
 
+from array import array
 from collections import OrderedDict
+from itertools import repeat
 from binascii import hexlify
 from enum import IntEnum
 from pprint import pprint
 
+from .packet import Packet
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# record offsets need 64 bits ('Q' is unavailable before Python 3.3)
+try:
+    OFFSET_TYPECODE = 'Q'
+    array(OFFSET_TYPECODE)
+except ValueError:
+    OFFSET_TYPECODE = 'L'
+
+# record type and record size preceding every record
+RECORD_LINK = struct.Struct("<BI")
+RECORD_SIZE = struct.Struct("<I")
+
+# game record type and timestamp
+GAME_RECORD_HEADER = struct.Struct("<BQ")
+RECORD_TIMESTAMP = struct.Struct("<Q")
+
+# game packet record up to the first two bytes of the payload string
+GAME_PACKET_HEADER = struct.Struct("<BQBBBB")
+
+if numpy is not None:
+    # sidecar index entries (INDEX_ENTRY_FMT)
+    INDEX_ENTRY_DTYPE = numpy.dtype([("type", "u1"), ("start", "<u8"), ("size", "<u4")])
+
+def _gather(data, offsets, width):
+    # little endian integers of the given width at each offset
+    columns = data[offsets.reshape(-1, 1) + numpy.arange(width, dtype=numpy.uint64)]
+    return columns.view("<u%d" % width).reshape(-1)
+
 class GCAPFormatError(Exception):
     pass
 
@@ -35,8 +72,72 @@ class GameRecordDestination(IntEnum):
     SERVER = 0
     CLIENT = 1
 
+class MetadataRecord(object):
+    __slots__ = ("number", "title", "description")
+
+    type = RecordType.METADATA
+
+    def __init__(self, number, title, description):
+        self.number = number
+        self.title = title
+        self.description = description
+
+    def to_dict(self):
+        return {
+            "type" : RecordType.METADATA.name,
+            "number" : self.number,
+            "record" : { "title" : self.title, "description" : self.description }
+        }
+
+class GamePacketRecord(object):
+    """
+    A game packet record. The packet type and destination are kept as
+    GameRecordPacketType and GameRecordDestination values.
+    """
+    __slots__ = ("number", "timestamp", "packet_type", "destination", "payload")
+
+    type = RecordType.GAME
+    game_type = GameRecordType.PACKET
+
+    def __init__(self, number, timestamp, packet_type, destination, payload):
+        self.number = number
+        self.timestamp = timestamp
+        self.packet_type = packet_type
+        self.destination = destination
+        self.payload = payload
+
+    def to_dict(self):
+        return {
+            "type" : RecordType.GAME.name,
+            "number" : self.number,
+            "record" : {
+                "type": GameRecordType.PACKET.name,
+                "timestamp": self.timestamp,
+                "record": {
+                    "type" : GameRecordPacketType(self.packet_type).name,
+                    "destination" : GameRecordDestination(self.destination).name,
+                    "record" : self.payload
+                }
+            }
+        }
+
 class GCAP(object):
     HEADER_LEN = 4 + 1 + 1 + 8 + 16 + 8 + 8 + 8 + 32
+    HEADER = struct.Struct("<4sBBQ16sQQQ") # header up to sha256_hash
+
+    # buffered copies when writing slices
+    COPY_CHUNK = 1 << 20
+
+    # record links read at once when building the index with NumPy
+    INDEX_CHUNK = 1 << 20
+
+    # sidecar record index (file.gcap.idx)
+    INDEX_MAGIC = b'GIDX'
+    INDEX_VERSION = 1
+    INDEX_HEADER_FMT = "<4sB16s32sQQ" # magic, version, guid, sha256_hash, file size, record count
+    INDEX_HEADER_LEN = struct.calcsize(INDEX_HEADER_FMT)
+    INDEX_ENTRY_FMT = "<BQI" # record type, record start, record size
+    INDEX_ENTRY_LEN = struct.calcsize(INDEX_ENTRY_FMT)
 
     @staticmethod
     def _parse_header(header):
@@ -65,29 +166,55 @@ class GCAP(object):
         return output
 
     @staticmethod
-    def _read_index_links(mmfile, start, amount):
-        index = []
+    def _read_index_links(mmfile, start, amount, types, starts, sizes):
+        if numpy is not None:
+            return GCAP._read_index_links_numpy(mmfile, start, amount, types, starts, sizes)
 
-        for i in range(amount):
-            recordType = struct.unpack_from("B", mmfile, start)[0]
-            recordSize = struct.unpack_from("I", mmfile, start+1)[0]
-            item = [[recordType, start+5, recordSize]]
+        # each header locates the next, so the scan is inherently sequential.
+        # keep the loop body to a single unpack and bound appends
+        unpackLink = RECORD_LINK.unpack_from
+        appendType = types.append
+        appendStart = starts.append
+        appendSize = sizes.append
 
-            index += item
-            start += 5 + recordSize
+        for i in repeat(None, amount):
+            recordType, recordSize = unpackLink(mmfile, start)
+            start += 5
 
-        return index
+            appendType(recordType)
+            appendStart(start)
+            appendSize(recordSize)
 
+            start += recordSize
 
     @staticmethod
-    def load(filename):
+    def _read_index_links_numpy(mmfile, start, amount, types, starts, sizes):
+        # only chase the record sizes in Python, then gather the record
+        # types and sizes from the header offsets in bulk. links are read
+        # INDEX_CHUNK at a time to bound the temporary arrays
+        unpackSize = RECORD_SIZE.unpack_from
+        data = numpy.frombuffer(mmfile, dtype=numpy.uint8)
 
-        fp = open(filename, 'rb')
-        mmfile = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
-        fp.close()
+        while amount > 0:
+            chunk = min(amount, GCAP.INDEX_CHUNK)
+            headers = array(OFFSET_TYPECODE)
+            appendHeader = headers.append
 
-        header = mmfile[0:GCAP.HEADER_LEN]
+            for i in repeat(None, chunk):
+                appendHeader(start)
+                start += 5 + unpackSize(mmfile, start+1)[0]
 
+            headers = numpy.frombuffer(headers, dtype='u%d' % headers.itemsize)
+            ends = numpy.append(headers[1:], start)
+
+            types.frombytes(data[headers].tobytes())
+            starts.frombytes((headers + 5).astype('u%d' % starts.itemsize).tobytes())
+            sizes.frombytes((ends - headers - 5).astype('u%d' % sizes.itemsize).tobytes())
+
+            amount -= chunk
+
+    @staticmethod
+    def _check_header(header):
         if len(header) != GCAP.HEADER_LEN:
             raise GCAPFormatError("invalid header size. got %d, expected %d" % (len(header), GCAP.HEADER_LEN))
 
@@ -101,11 +228,46 @@ class GCAP(object):
         if headerHash != compareHash:
             raise GCAPFormatError("header corrupted")
 
-        return GCAP(".".join([str(parsed['version_major']), str(parsed['version_minor'])]),
-                parsed, mmfile)
+        return parsed
+
+    @staticmethod
+    def load(filename, index=None, zero_copy=False):
+        """
+        Open a GCAP file. If index is True, a sidecar record index at
+        filename + ".idx" is used (and created if missing or stale). A path
+        may also be given to place the index elsewhere.
+
+        With zero_copy, record payloads are returned as memoryviews over the
+        capture instead of bytes. They are only valid until close().
+        """
+
+        fp = open(filename, 'rb')
+
+        # empty files cannot be mapped
+        if os.fstat(fp.fileno()).st_size == 0:
+            fp.close()
+            raise GCAPFormatError("invalid header size. got 0, expected %d" % GCAP.HEADER_LEN)
+
+        mmfile = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+        fp.close()
+
+        parsed = GCAP._check_header(mmfile[0:GCAP.HEADER_LEN])
+
+        gcap = GCAP(".".join([str(parsed['version_major']), str(parsed['version_minor'])]),
+                parsed, mmfile, zero_copy)
+        gcap.filename = filename
+
+        if index:
+            indexFilename = filename + ".idx" if index is True else index
 
-    def _decode_var_string(self, data):
-        firstByte = struct.unpack_from("B", data)[0]
+            if not gcap.load_index(indexFilename) and gcap.save_index(indexFilename):
+                gcap.load_index(indexFilename)
+
+        return gcap
+
+    @staticmethod
+    def _decode_var_string(data, offset=0, copy=True):
+        firstByte = struct.unpack_from("B", data, offset)[0]
 
         # At the moment, all strings are treated the same
         # regardless of type
@@ -114,26 +276,29 @@ class GCAP(object):
 
         # 1 byte
         if stringSize == 0:
-            size = struct.unpack_from("B", data, 1)[0]
-            nextPointer = 1 + 1 + size
-            stringOut = data[2:2+size]
+            size = struct.unpack_from("B", data, offset+1)[0]
+            stringStart = offset + 1 + 1
         # 2 bytes
         elif stringSize == 1:
-            size = struct.unpack_from("H", data, 1)[0]
-            nextPointer = 1 + 2 + size
-            stringOut = data[3:3+size]
+            size = struct.unpack_from("H", data, offset+1)[0]
+            stringStart = offset + 1 + 2
         # 4 bytes
         elif stringSize == 2:
-            size = struct.unpack_from("I", data, 1)[0]
-            nextPointer = 1 + 4 + size
-            stringOut = data[5:5+size]
+            size = struct.unpack_from("I", data, offset+1)[0]
+            stringStart = offset + 1 + 4
         else:
             raise GCAPFormatError("unsupported variable string type")
 
+        nextPointer = stringStart + size
+        stringOut = data[stringStart:nextPointer]
 
-        return (stringOut if sys.version_info[0] < 3 or stringType == 2 else stringOut.decode('utf-8'), nextPointer)
+        if sys.version_info[0] < 3 or stringType == 2:
+            # views are only handed out in zero copy mode
+            return (bytes(stringOut) if copy else stringOut, nextPointer)
+        else:
+            return (bytes(stringOut).decode('utf-8'), nextPointer)
 
-    def __init__(self, version, header, mmfile):
+    def __init__(self, version, header, mmfile, zero_copy=False):
         version_parts = version.split(".")
 
         if len(version_parts) != 2:
@@ -142,9 +307,11 @@ class GCAP(object):
         self.major = int(version_parts[0])
         self.minor = int(version_parts[1])
         self.header = header
-        self.mmfile = mmfile
-        self.index = {}
-        self.indexWatermark = -1 # start with a blank index
+        self._map(mmfile)
+        self.zeroCopy = zero_copy
+        self._reset_index()
+        self.indexFile = None # mmap of a validated sidecar index
+        self.filename = None # set when opened with load()
 
         if self.major == 1 and self.minor == 0:
             pass
@@ -155,37 +322,34 @@ class GCAP(object):
         for i in range(self.record_count()):
             yield self.get_record(i)
 
+    def _reset_index(self):
+        # one column per link field, 13 bytes per record
+        self.indexTypes = array('B')
+        self.indexStarts = array(OFFSET_TYPECODE)
+        self.indexSizes = array('I')
+        self.indexWatermark = -1 # start with a blank index
+
     def _fetch_and_cache_index_link(self, position):
-        if self.indexWatermark == -1: # fresh index
-            idx = GCAP._read_index_links(self.mmfile, GCAP.HEADER_LEN, position+1)
+        # we haven't built an index up to this position yet
+        if self.indexWatermark < position:
+            if self.indexWatermark == -1: # fresh index
+                start = GCAP.HEADER_LEN
+            else:
+                start = self.indexStarts[-1] + self.indexSizes[-1]
 
-            for i,v in enumerate(idx):
-                self.index[i] = v
+            GCAP._read_index_links(self.mmfile, start, position-self.indexWatermark,
+                    self.indexTypes, self.indexStarts, self.indexSizes)
 
             self.indexWatermark = position
 
-            return self.index[position]
-        else:
-            # we haven't built an index up to this position yet
-            if self.indexWatermark < position:
-                startItem = self.index[self.indexWatermark]
-                start = startItem[1] + startItem[2]
-
-                idx = GCAP._read_index_links(self.mmfile, start, position-self.indexWatermark)
-                for i in range(self.indexWatermark+1, position+1):
-                    self.index[i] = idx[i-(self.indexWatermark+1)]
-
-                self.indexWatermark = position
-
-                return self.index[position]
-            else:
-                return self.index[position]
+        return (self.indexTypes[position], self.indexStarts[position], self.indexSizes[position])
 
     def _get_record_index(self, position):
         assert position >= 0 and position < self.record_count()
 
-        if position in self.index:
-            return self.index[position]
+        if self.indexFile is not None:
+            return struct.unpack_from(GCAP.INDEX_ENTRY_FMT, self.indexFile,
+                    GCAP.INDEX_HEADER_LEN + position*GCAP.INDEX_ENTRY_LEN)
         else:
             return self._fetch_and_cache_index_link(position)
 
@@ -199,37 +363,453 @@ class GCAP(object):
         link = self._get_record_index(position)
         return link[2] + link[1]
 
-    def get_metadata(self):
-        if self.record_count() > 0 and self._get_record_type(0) == RecordType.METADATA:
-            # extract title and description
-            inner_meta = self.get_record(0)
-
-            # and add them to header metadata
-            metadata = {
-                    "version": ".".join([str(self.header['version_major']), str(self.header['version_minor'])]),
-                    "capture_revision": self.header['capture_revision'],
-                    "guid": self.header['guid'],
-                    "start_time": self.header['start'],
-                    "end_time": self.header['end'],
-                    "record_count": self.header['record_count'],
-                    "sha256_hash": self.header['sha256_hash'],
-            }
+    def _index_header(self):
+        return struct.pack(GCAP.INDEX_HEADER_FMT, GCAP.INDEX_MAGIC, GCAP.INDEX_VERSION,
+                self.header['guid'], self.header['sha256_hash'],
+                len(self.mmfile), self.record_count())
 
-            inner_meta['record'].update(metadata)
+    def load_index(self, filename):
+        """
+        Attach a sidecar index written by save_index. Returns False if the
+        index is missing or does not belong to this capture.
+        """
+        try:
+            fp = open(filename, 'rb')
+        except IOError:
+            return False
+
+        try:
+            expected = GCAP.INDEX_HEADER_LEN + self.record_count()*GCAP.INDEX_ENTRY_LEN
+
+            if os.fstat(fp.fileno()).st_size != expected:
+                return False
+
+            indexFile = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            fp.close()
+
+        if indexFile[0:GCAP.INDEX_HEADER_LEN] != self._index_header():
+            indexFile.close()
+            return False
+
+        # the sidecar supersedes anything scanned so far
+        self.indexFile = indexFile
+        self._reset_index()
+
+        return True
+
+    def save_index(self, filename):
+        """
+        Scan every record header and write a sidecar index to filename.
+        Returns False if the index could not be written.
+        """
+        count = self.record_count()
+
+        if count > 0 and self.indexFile is None:
+            self._get_record_index(count-1)
+
+        tmpFilename = filename + ".tmp"
+
+        try:
+            with open(tmpFilename, 'wb') as fp:
+                fp.write(self._index_header())
+
+                for chunk in range(0, count, 65536):
+                    fp.write(b"".join([struct.pack(GCAP.INDEX_ENTRY_FMT, *self._get_record_index(i))
+                        for i in range(chunk, min(chunk+65536, count))]))
+
+            # os.replace overwrites a stale index on all platforms
+            getattr(os, 'replace', os.rename)(tmpFilename, filename)
+        except (IOError, OSError):
+            if os.path.exists(tmpFilename):
+                os.remove(tmpFilename)
+
+            return False
+
+        return True
+
+    @staticmethod
+    def _metadata_dict(header, metaRecord):
+        # extract title and description
+        inner_meta = metaRecord.to_dict()
 
-            return inner_meta
+        # and add them to header metadata
+        metadata = {
+                "version": ".".join([str(header['version_major']), str(header['version_minor'])]),
+                "capture_revision": header['capture_revision'],
+                "guid": header['guid'],
+                "start_time": header['start'],
+                "end_time": header['end'],
+                "record_count": header['record_count'],
+                "sha256_hash": header['sha256_hash'],
+        }
+
+        inner_meta['record'].update(metadata)
+
+        return inner_meta
+
+    def get_metadata(self):
+        if self.record_count() > 0 and self._get_record_type(0) == RecordType.METADATA:
+            return GCAP._metadata_dict(self.header, self.read_record(0))
         else:
             raise GCAPFormatError("all GCAP files must have a metadata record as the first record")
 
     def record_count(self):
         return self.header['record_count']
 
+    def _get_timestamp(self, position):
+        # game records carry microseconds since the start of the capture.
+        # other records take the timestamp of the game record before them
+        while position > 0:
+            recType, recordStart, recordSize = self._get_record_index(position)
+
+            if recType == RecordType.GAME:
+                return RECORD_TIMESTAMP.unpack_from(self.mmfile, recordStart+1)[0]
+
+            position -= 1
+
+        return 0
+
+    def _bisect_time(self, timestamp, lo, hi):
+        # first record in [lo, hi) timestamped at or after timestamp.
+        # only the records probed are read
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            if self._get_timestamp(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def find_time_range(self, t0, t1=None):
+        """
+        Return the record numbers (first, last+1) of the records timestamped
+        within [t0, t1) seconds from the start of the capture. A t1 of None
+        selects up to the end of the capture.
+        """
+        count = self.record_count()
+        first = self._bisect_time(int(round(t0*1e6)), 0, count)
+
+        if t1 is None:
+            end = count
+        else:
+            end = self._bisect_time(int(round(t1*1e6)), first, count)
+
+        return (first, end)
+
+    def records_between(self, t0, t1=None):
+        """
+        Yield the game records timestamped within [t0, t1) seconds from the
+        start of the capture.
+        """
+        first, end = self.find_time_range(t0, t1)
+
+        for i in range(first, end):
+            if self._get_record_type(i) == RecordType.GAME:
+                yield self.get_record(i)
+
     def get_record(self, which):
+        return self.read_record(which).to_dict()
+
+    def iter_records(self):
+        for i in range(self.record_count()):
+            yield self.read_record(i)
+
+    def _index_arrays(self):
+        """
+        Return the record type, start and size of every record as NumPy
+        arrays.
+        """
+        count = self.record_count()
+
+        if self.indexFile is not None:
+            entries = numpy.frombuffer(self.indexFile, dtype=INDEX_ENTRY_DTYPE,
+                    count=count, offset=GCAP.INDEX_HEADER_LEN)
+
+            return (entries['type'].copy(), entries['start'].astype(numpy.uint64),
+                    entries['size'].astype(numpy.uint32))
+
+        if count > 0:
+            self._get_record_index(count-1)
+
+        return (numpy.frombuffer(self.indexTypes, dtype=numpy.uint8).copy(),
+                numpy.frombuffer(self.indexStarts, dtype='u%d' % self.indexStarts.itemsize).astype(numpy.uint64),
+                numpy.frombuffer(self.indexSizes, dtype='u%d' % self.indexSizes.itemsize).astype(numpy.uint32))
+
+    def to_columns(self):
+        """
+        Return the game packet records as NumPy columns, keyed by name:
+
+          number          record number
+          timestamp       microseconds since the start of the capture
+          destination     GameRecordDestination value
+          packet_type     GameRecordPacketType value
+          payload_offset  offset of the payload in the capture file
+          payload_length  payload size in bytes
+          opcode          first payload byte, or -1 for an empty payload
+
+        Payloads stay in the capture; slice them from gcap.mmfile with the
+        offset and length columns.
+        """
+        if numpy is None:
+            raise ImportError("GCAP.to_columns requires numpy")
+
+        types, starts, sizes = self._index_arrays()
+        data = numpy.frombuffer(self.mmfile, dtype=numpy.uint8)
+
+        number = numpy.flatnonzero(types == RecordType.GAME)
+        starts = starts[number]
+
+        if numpy.any(data[starts] != GameRecordType.PACKET):
+            raise GCAPFormatError("unsupported game record type")
+
+        # the payload is a variable string with a 1, 2 or 4 byte size
+        sizeClass = data[starts + 11] >> 6
+
+        if numpy.any(sizeClass > 2):
+            raise GCAPFormatError("unsupported variable string type")
+
+        # wider sizes are only gathered where present to stay within the file
+        sizeWidth = numpy.array([1, 2, 4], dtype=numpy.uint64)[sizeClass]
+        payloadLength = data[starts + 12].astype(numpy.uint32)
+
+        for width, which in ((2, 1), (4, 2)):
+            wide = sizeClass == which
+
+            if numpy.any(wide):
+                payloadLength[wide] = _gather(data, starts[wide] + 12, width)
+
+        payloadOffset = starts + 12 + sizeWidth
+
+        opcode = numpy.full(len(number), -1, dtype=numpy.int16)
+        nonEmpty = payloadLength > 0
+        opcode[nonEmpty] = data[payloadOffset[nonEmpty]]
+
+        return OrderedDict([
+            ("number", number.astype(numpy.uint64)),
+            ("timestamp", _gather(data, starts + 1, 8)),
+            ("destination", data[starts + 10]),
+            ("packet_type", data[starts + 9]),
+            ("payload_offset", payloadOffset),
+            ("payload_length", payloadLength),
+            ("opcode", opcode),
+        ])
+
+    def save_columns(self, filename=None):
+        """
+        Save to_columns() as a NumPy .npz archive, by default next to the
+        capture as file.gcap.npz. Returns the filename written.
+        """
+        if filename is None:
+            filename = self.filename + ".npz"
+
+        with open(filename, 'wb') as fp:
+            numpy.savez(fp, **self.to_columns())
+
+        return filename
+
+    def to_packet_columns(self):
+        """
+        Return every packet of the capture as NumPy columns, keyed by name,
+        with server bound payloads unrolled into the packets they bundle:
+
+          number       record number the packet came from
+          timestamp    microseconds since the start of the capture
+          destination  GameRecordDestination value
+          offset       offset of the packet in the capture file
+          length       packet size in bytes
+          type         PacketType value, or -1 for an invalid packet
+          id           packet id within its type, or -1
+          unknown      whether the packet id is an unknown packet
+        """
+        if numpy is None:
+            raise ImportError("GCAP.to_packet_columns requires numpy")
+
+        columns = self.to_columns()
+        data = numpy.frombuffer(self.mmfile, dtype=numpy.uint8)
+
+        rows, offsets, lengths = Packet.unroll_columns(data, columns['payload_offset'],
+                columns['payload_length'], columns['destination'] == GameRecordDestination.SERVER)
+        ptype, pid, unknown = Packet.classify_columns(data, offsets, lengths)
+
+        return OrderedDict([
+            ("number", columns['number'][rows]),
+            ("timestamp", columns['timestamp'][rows]),
+            ("destination", columns['destination'][rows]),
+            ("offset", offsets),
+            ("length", lengths),
+            ("type", ptype),
+            ("id", pid),
+            ("unknown", unknown),
+        ])
+
+    def _header_bytes(self, header):
+        fields = GCAP.HEADER.pack(header['magic'], header['version_major'], header['version_minor'],
+                header['capture_revision'], header['guid'], header['start'], header['end'],
+                header['record_count'])
+
+        return fields + hashlib.sha256(fields).digest()
+
+    def _copy_range(self, fp, start, end):
+        # let the kernel copy between the files when it can
+        if self.filename is not None:
+            copyRange = getattr(os, 'copy_file_range', None)
+            sendfile = getattr(os, 'sendfile', None)
+
+            try:
+                with open(self.filename, 'rb') as src:
+                    fp.flush()
+
+                    while start < end and copyRange is not None:
+                        copied = copyRange(src.fileno(), fp.fileno(), end - start, start)
+
+                        if copied == 0:
+                            break
+
+                        start += copied
+
+                    while start < end and sendfile is not None:
+                        copied = sendfile(fp.fileno(), src.fileno(), start, end - start)
+
+                        if copied == 0:
+                            break
+
+                        start += copied
+
+                # the descriptor position moved underneath the file object
+                fp.seek(0, os.SEEK_END)
+            except OSError:
+                fp.seek(0, os.SEEK_END)
+
+        while start < end:
+            chunk = min(end - start, GCAP.COPY_CHUNK)
+            fp.write(self.mmfile[start:start+chunk])
+            start += chunk
+
+    def write_slice(self, filename, first, last):
+        """
+        Write records first through last (inclusive) as a new capture,
+        along with the metadata record. The records are copied as is, so
+        their timestamps stay relative to the original capture start. The
+        slice gets its own GUID, derived from the original GUID and range.
+        """
+        count = self.record_count()
+        first = max(first, 1)
+        last = min(last, count - 1)
+
+        if count == 0 or self._get_record_type(0) != RecordType.METADATA:
+            raise GCAPFormatError("all GCAP files must have a metadata record as the first record")
+
+        if first > last:
+            raise IndexError("empty record range %d-%d" % (first, last))
+
+        lastType, lastStart, lastSize = self._get_record_index(last)
+
+        header = dict(self.header)
+        header['guid'] = hashlib.sha256(self.header['guid'] + struct.pack("<QQ", first, last)).digest()[:16]
+        header['record_count'] = 2 + last - first # and the metadata record
+
+        if lastType == RecordType.GAME:
+            lastTimestamp = RECORD_TIMESTAMP.unpack_from(self.mmfile, lastStart+1)[0]
+            header['end'] = min(self.header['end'], self.header['start'] + (lastTimestamp + 999999) // 1000000)
+
+        with open(filename, 'wb') as fp:
+            fp.write(self._header_bytes(header))
+            self._copy_range(fp, GCAP.HEADER_LEN, self._get_record_end(0))
+            self._copy_range(fp, self._get_record_start(first) - 5, lastStart + lastSize)
+
+    def iter_packets(self):
+        """
+        Yield (number, timestamp, destination, payload) for every game packet
+        record. This scans the capture sequentially without building the
+        record index or record objects, and is the fastest way to visit
+        every packet. Payloads follow the zero_copy setting.
+        """
+        buf = self.mmview
+        unpackLink = RECORD_LINK.unpack_from
+        unpackPacket = GAME_PACKET_HEADER.unpack_from
+        zeroCopy = self.zeroCopy
+        position = GCAP.HEADER_LEN
+
+        for number in range(self.record_count()):
+            recType, recordSize = unpackLink(buf, position)
+            position += 5
+
+            if recType == RecordType.GAME:
+                grecType, timestamp, gamePacketType, gamePacketDest, firstByte, size = \
+                        unpackPacket(buf, position)
+
+                if grecType != GameRecordType.PACKET:
+                    raise GCAPFormatError("unsupported game record type")
+
+                # fast path for payloads with a one byte size
+                if firstByte & 0xc0 == 0:
+                    payloadStart = position + 13
+                    payload = buf[payloadStart:payloadStart+size]
+
+                    yield (number, timestamp, gamePacketDest, payload if zeroCopy else bytes(payload))
+                else:
+                    rawRecord = buf[position:position+recordSize]
+
+                    yield (number, timestamp, gamePacketDest,
+                            GCAP._decode_var_string(rawRecord, 11, not zeroCopy)[0])
+
+            position += recordSize
+
+    def iter_matching(self, packet_filter, first=1, last=None):
+        """
+        Yield the game packet records first through last (inclusive) that
+        match packet_filter (see PacketFilter) as GamePacketRecord objects.
+        Records are only decoded when they match.
+        """
+        if last is None or last >= self.record_count():
+            last = self.record_count() - 1
+
+        first = max(first, 0)
+
+        if first > last:
+            return
+
+        buf = self.mmview
+        unpackLink = RECORD_LINK.unpack_from
+        unpackPacket = GAME_PACKET_HEADER.unpack_from
+        matches = packet_filter.matches
+        copy = not self.zeroCopy
+        position = self._get_record_index(first)[1] - 5
+
+        for number in range(first, last + 1):
+            recType, recordSize = unpackLink(buf, position)
+            position += 5
+
+            if recType == RecordType.GAME:
+                grecType, timestamp, gamePacketType, gamePacketDest, firstByte, size = \
+                        unpackPacket(buf, position)
+
+                if grecType != GameRecordType.PACKET:
+                    raise GCAPFormatError("unsupported game record type")
+
+                if firstByte & 0xc0 == 0:
+                    payload = buf[position+13:position+13+size]
+                else:
+                    payload = GCAP._decode_var_string(buf[position:position+recordSize], 11, False)[0]
+
+                if matches(gamePacketDest, payload):
+                    yield GCAP._decode_record(number, recType, buf[position:position+recordSize], copy)
+
+            position += recordSize
+
+    def read_record(self, which):
+        """
+        Decode a record into a MetadataRecord or GamePacketRecord.
+        get_record returns the same record as nested dicts.
+        """
         if which < 0 or which > self.record_count():
             raise IndexError("invalid record index")
 
         # fetch a fair amount of index items at once (favors sequential access)
-        if which < self.indexWatermark and abs(which - self.indexWatermark) < 10:
+        if self.indexFile is None and which > self.indexWatermark - 10:
             self._fetch_and_cache_index_link(min(which+300, self.record_count()-1))
 
         # decode the record based off of type
@@ -238,54 +818,142 @@ class GCAP(object):
         recType = idx[0]
         recordStart = idx[1]
         recordEnd = idx[2] + recordStart
-        rawRecord = self.mmfile[recordStart:recordEnd]
+        rawRecord = self.mmview[recordStart:recordEnd]
 
-        result = { "type" : RecordType(recType).name, "number" : which }
+        return GCAP._decode_record(which, recType, rawRecord, not self.zeroCopy)
 
+    @staticmethod
+    def _decode_record(which, recType, rawRecord, copy=True):
         if recType == RecordType.METADATA:
-            title, nextByte = self._decode_var_string(rawRecord)
-            description, nextByte = self._decode_var_string(rawRecord[nextByte:])
+            title, nextByte = GCAP._decode_var_string(rawRecord)
+            description, nextByte = GCAP._decode_var_string(rawRecord, nextByte)
 
-            result.update({
-                "record" : { "title" : title, "description" : description }
-            })
+            return MetadataRecord(which, title, description)
         elif recType == RecordType.GAME:
             # type, timestamp, octal payload
-            grecType = struct.unpack_from("B", rawRecord)[0]
-            timestamp = struct.unpack_from("Q", rawRecord, 1)[0]
-            rest = rawRecord[9:]
-            innerRec = {}
+            grecType, timestamp = GAME_RECORD_HEADER.unpack_from(rawRecord)
 
             if grecType == GameRecordType.CRYPTO:
                 raise GCAPFormatError("unsupported game record type")
             elif grecType == GameRecordType.PACKET:
-                gamePacketType, gamePacketDest = struct.unpack_from("BB", rest)
-                rec, nextByte = self._decode_var_string(rest[2:])
+                gamePacketType, gamePacketDest = struct.unpack_from("BB", rawRecord, 9)
+                rec, nextByte = GCAP._decode_var_string(rawRecord, 11, copy)
 
-                innerRec = {
-                        "type" : GameRecordPacketType(gamePacketType).name,
-                        "destination" : GameRecordDestination(gamePacketDest).name,
-                        "record" : rec
-                }
+                if gamePacketType > GameRecordPacketType.GAME or gamePacketDest > GameRecordDestination.CLIENT:
+                    raise GCAPFormatError("unsupported game packet record")
+
+                return GamePacketRecord(which, timestamp, gamePacketType, gamePacketDest, rec)
             else:
                 raise GCAPFormatError("unsupported game record type")
+        else:
+            raise GCAPFormatError("unsupported record type %d" % recType)
 
-            result.update({
-                "record" : {
-                    "type": GameRecordType(grecType).name,
-                    "timestamp": timestamp,
-                    "record": innerRec
-                }
-            })
+    def _map(self, mmfile):
+        self.mmfile = mmfile
+        # records are decoded from views over the mapping. mmap only supports
+        # memoryview from Python 3 onwards, so Python 2 slices the mmap instead
+        self.mmview = memoryview(mmfile) if sys.version_info[0] >= 3 else mmfile
+
+    def _unmap(self):
+        if self.mmview is not self.mmfile:
+            self.mmview.release()
+
+        try:
+            self.mmfile.close()
+        except BufferError:
+            # zero copy payloads are still referenced. the mapping is
+            # released once the last of them is garbage collected
+            pass
+
+    def _remap(self):
+        """
+        Map the capture again if it has grown. Returns True if it did.
+        """
+        with open(self.filename, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size <= len(self.mmfile):
+                return False
+
+            mmfile = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+
+        self._unmap()
+        self._map(mmfile)
 
-            return result
+        return True
+
+    def _extend_index(self):
+        """
+        Index the complete records past the watermark, ignoring the record
+        count in the header. Returns the number of records indexed.
+        """
+        size = len(self.mmfile)
+        unpackLink = RECORD_LINK.unpack_from
+        added = 0
+
+        if self.indexWatermark == -1:
+            position = GCAP.HEADER_LEN
         else:
-            raise GCAPFormatError("unsupported record type %d" % recType)
+            position = self.indexStarts[-1] + self.indexSizes[-1]
+
+        while position + 5 <= size:
+            recordType, recordSize = unpackLink(self.mmfile, position)
+
+            # the rest of the record has not been written yet
+            if position + 5 + recordSize > size:
+                break
+
+            self.indexTypes.append(recordType)
+            self.indexStarts.append(position + 5)
+            self.indexSizes.append(recordSize)
+
+            position += 5 + recordSize
+            added += 1
+
+        self.indexWatermark += added
 
-        return result
+        return added
+
+    def follow(self, first=0, poll_interval=0.5, idle_timeout=None):
+        """
+        Yield record objects from first onwards while the capture is still
+        being written, waiting for new records once the end is reached.
+        The record count is taken from the records present in the file and
+        kept up to date in the header. Stops after idle_timeout seconds
+        without new records, or never if it is None.
+        """
+        if self.filename is None:
+            raise ValueError("only captures opened with GCAP.load can be followed")
+
+        # a sidecar index only covers the capture as it was
+        if self.indexFile is not None:
+            self.indexFile.close()
+            self.indexFile = None
+
+        idle = 0.0
+
+        while True:
+            self._extend_index()
+
+            if self.record_count() != self.indexWatermark + 1:
+                self.header['record_count'] = self.indexWatermark + 1
+
+            if first < self.record_count():
+                idle = 0.0
+
+                while first < self.record_count():
+                    yield self.read_record(first)
+                    first += 1
+            elif idle_timeout is not None and idle >= idle_timeout:
+                return
+            elif not self._remap():
+                time.sleep(poll_interval)
+                idle += poll_interval
 
     def close(self):
-        self.mmfile.close()
+        self._unmap()
+
+        if self.indexFile is not None:
+            self.indexFile.close()
+            self.indexFile = None
 
 if __name__ == "__main__":
     gcap = GCAP.load("test.gcap")
@@ -3,6 +3,8 @@ import getopt
 from functools import reduce
 
 from .process import *
+from .compress import CODECS
+from .packet import PacketFilter
 from . import util
 
 # global exename for usage in the program
@@ -12,6 +14,9 @@ exename = ""
 START_OF_FILE = -1
 END_OF_FILE = 4000000000
 
+# placeholder for the end of a time window
+END_OF_TIME = float('inf')
+
 def usage(reason = ''):
     if reason != '':
         print("Error: " + reason)
@@ -20,10 +25,22 @@ def usage(reason = ''):
     print("""\
 usage: %s [options] file.gcap [file2.gcap..]
 
+Use - as the file to read a capture from standard input. Block compressed
+captures and gzip, bz2 or xz compressed captures are read transparently.
+
 Action:
 -m    Display GCAP metadata
 -x    Extract GCAP records
 -s    Run statistics on the selected Game Packets
+-c    Compress each file into a block compressed capture (file.gcapz)
+      that supports fast random access
+      --codec=zlib|bz2|lzma   block compression codec (default: zlib)
+--follow
+      With -x, keep extracting records as they are appended to a capture
+      that is still being written, until interrupted. Needs a single file
+--slice=out.gcap
+      Write the selected records to a new GCAP file, along with the
+      metadata record. Needs a single file and a single range or time window
 
 Selection:
 -r    select slices from the GCAP file starting at 1
@@ -35,6 +52,24 @@ Selection:
 
       Slicing will only work when one file is passed in. With multiple files,
       extraction and statistics will be run on all records.
+-t    select records by time, in seconds from the start of the capture.
+      Each window includes its start and excludes its end. Cannot be
+      combined with -r
+      Examples:
+        -t 600-660      selects records from 10 to 11 minutes in
+        -t 0-30,90-     selects the first 30 seconds and everything after 90
+
+Filters (with -x):
+-p    only extract records carrying the named packets, including packets
+      bundled in MultiPackets and SlottedMetaPackets
+      Example:
+        -p HitMessage,DamageMessage
+--dst=CLIENT|SERVER
+      only extract records sent to the client or to the server
+
+Indexing:
+-i    use a sidecar record index (file.gcap.idx) for fast random access,
+      creating it on the first run
 
 Output modes:
 -j    JSON output mode
@@ -72,7 +107,7 @@ def parse_ranges(text):
                     return []
 
                 output.append((number, number))
-            except ValueError as e:
+            except ValueError:
                 return []
         # range of numbers
         elif len(interval) == 2:
@@ -106,13 +141,40 @@ def parse_ranges(text):
                     return []
 
                 output.append((lnumber, rnumber))
-            except ValueError as e:
+            except ValueError:
                 return []
         else:
             return []
 
     return output
 
+def parse_times(text):
+    # remove all whitespace
+    text = "".join(text.split())
+
+    # look for multiple windows in one argument
+    windows = text.split(',')
+    output = []
+
+    for w in windows:
+        interval = w.split('-')
+
+        if len(interval) != 2:
+            return []
+
+        try:
+            lnumber = 0.0 if interval[0] == "" else float(interval[0])
+            rnumber = END_OF_TIME if interval[1] == "" else float(interval[1])
+        except ValueError:
+            return []
+
+        if lnumber < 0 or lnumber >= rnumber:
+            return []
+
+        output.append((lnumber, rnumber))
+
+    return output
+
 """
 Returns a sorted set of unique, minimal ranges in O(nlogn) time
 """
@@ -155,7 +217,7 @@ def main():
         argv = argv[1:]
 
     try:
-        opt, tail = getopt.getopt(argv, "hmxsr:jao", ["help"])
+        opt, tail = getopt.getopt(argv, "hmxscr:t:p:ijao", ["help", "codec=", "slice=", "follow", "dst="])
     except getopt.error as err:
         usage(err.msg)
 
@@ -163,8 +225,17 @@ def main():
     opt_disp_meta = False
     opt_extract = False
     opt_stats = False
+    opt_compress = False
+    opt_codec = "zlib"
+    opt_slice = None
+    opt_follow = False
 
     opt_ranges = []
+    opt_times = []
+    opt_index = False
+
+    opt_packets = None
+    opt_dst = None
 
     opt_output_json = False
     opt_output_ascii = False
@@ -186,6 +257,17 @@ def main():
             opt_extract = True
         elif o == "-s":
             opt_stats = True
+        elif o == "-c":
+            opt_compress = True
+        elif o == "--codec":
+            if val not in CODECS:
+                usage("Unsupported codec %s (argument %d)" % (val, argument))
+
+            opt_codec = val
+        elif o == "--slice":
+            opt_slice = val
+        elif o == "--follow":
+            opt_follow = True
         elif o == "-r":
             new_ranges = parse_ranges(val)
 
@@ -193,6 +275,27 @@ def main():
                 usage("Invalid range specification (argument %d)" % argument)
 
             opt_ranges.extend(new_ranges)
+        elif o == "-t":
+            new_times = parse_times(val)
+
+            if len(new_times) == 0:
+                usage("Invalid time specification (argument %d)" % argument)
+
+            opt_times.extend(new_times)
+        elif o == "-p":
+            names = [n for n in "".join(val.split()).split(',') if n != ""]
+
+            if len(names) == 0:
+                usage("Invalid packet name list (argument %d)" % argument)
+
+            opt_packets = (opt_packets or []) + names
+        elif o == "--dst":
+            if val.upper() not in GameRecordDestination.__members__:
+                usage("Invalid destination %s (argument %d)" % (val, argument))
+
+            opt_dst = GameRecordDestination[val.upper()]
+        elif o == "-i":
+            opt_index = True
         elif o == "-j":
             opt_output_json = True
         elif o == "-a":
@@ -221,6 +324,27 @@ def main():
         actions += [GCAPyAction.Extract]
     if opt_stats:
         actions += [GCAPyAction.Stats]
+    if opt_compress:
+        actions += [GCAPyAction.Compress]
+    if opt_slice is not None:
+        actions += [GCAPyAction.Slice]
+
+        if len(tail) != 1:
+            usage("Slicing needs exactly one file")
+
+    if opt_follow and (not opt_extract or len(tail) != 1):
+        usage("Following needs record extraction from exactly one file")
+
+    packet_filter = None
+
+    if opt_packets is not None or opt_dst is not None:
+        if not opt_extract:
+            usage("Packet filters only apply to record extraction")
+
+        try:
+            packet_filter = PacketFilter(opt_packets, opt_dst)
+        except ValueError as e:
+            usage(str(e))
 
     # make sure at least one action has been specified
     if len(actions) == 0:
@@ -263,12 +387,20 @@ def main():
     # process the ranges
     ######################
 
+    if len(opt_ranges) and len(opt_times):
+        usage("Record ranges and time windows cannot be combined")
+
     #print("Ranges: " + str(opt_ranges))
     opt_ranges = combine_ranges(opt_ranges)
+    opt_times = combine_ranges(opt_times)
     #print("MinRanges: " + str(opt_ranges))
 
+    # time windows are resolved to ranges per file
+    if len(opt_times):
+        if opt_disp_meta and soleAction:
+            warning("time windows specified but only displaying metadata")
     # no ranges, assume the whole file
-    if not len(opt_ranges):
+    elif not len(opt_ranges):
         opt_ranges = [(START_OF_FILE, END_OF_FILE)]
 
     # TODO: make prints go to stderr
@@ -281,7 +413,8 @@ def main():
         if opt_disp_meta and soleAction:
             warning("ranges specified but only displaying metadata")
 
-    exit(process_gcapy(tail, opt_ranges, actions, output))
+    exit(process_gcapy(tail, opt_ranges, actions, output, opt_index, opt_times, opt_codec, opt_slice, opt_follow,
+        packet_filter))
 
 if __name__ == "__main__":
     main()
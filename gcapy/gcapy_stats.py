@@ -1,16 +1,32 @@
 #!/usr/bin/env python
+from __future__ import print_function
 import sys
+import json
 import argparse
 import binascii
-import shelve
+import os
+import hashlib
+import multiprocessing
+from array import array
 from datetime import datetime
 from pprint import PrettyPrinter
 
-from .stats import Stats
+from .stats import Stats, StatsFormatError, save_stats, load_stats
 from . import __version__
 from . import packet_names
 from .gcap import *
+from .compress import open_capture
 from .packet import Packet,PacketType, PacketDest
+from .codec import CodecError, get_codec
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# errors that fail a single capture or stats file rather than the whole run.
+# ValueError covers undecodable metadata and mismatched stats
+CAPTURE_ERRORS = (IOError, GCAPFormatError, GCAPVersionError, StatsFormatError, ValueError)
 
 def error(msg):
     sys.stderr.write("error: " + msg + "\n")
@@ -20,154 +36,367 @@ def info(msg):
 
 def main():
     parser = argparse.ArgumentParser(description='Gather stats on GCAP files')
-    parser.add_argument('--cache', help='GCAP statistics cache')
-    parser.add_argument('files', nargs='+', metavar='files', help='GCAP file')
+    parser.add_argument('--cache', metavar='DIR',
+            help='directory of per capture stats files, reused while the captures are unchanged')
+    parser.add_argument('--save', metavar='FILE', help='also write the combined statistics to a stats file')
+    parser.add_argument('--merge', action='store_true',
+            help='combine stats files written with --save instead of reading captures')
+    parser.add_argument('--field', action='append', default=[], metavar='PACKET.FIELD',
+            help='count the values of a decoded packet field, such as ChatMsg.message_type (repeatable)')
+    parser.add_argument('--json', action='store_true', help='output the statistics as JSON')
+    parser.add_argument('--bucket', type=float, default=1.0, metavar='SECONDS',
+            help='width of the buckets peak rates are measured over (default: 1)')
+    parser.add_argument('--series', metavar='FILE',
+            help='write the packet and byte rates of each direction over time to a CSV file (requires numpy)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+            help='gather the statistics of N captures at once in worker processes (0 for one per CPU)')
+    parser.add_argument('files', nargs='+', metavar='files',
+            help='GCAP file (- for standard input), or stats file with --merge')
     args = parser.parse_args()
 
-    print("GCAPy Stats " + __version__)
-    print("")
+    if args.bucket <= 0:
+        parser.error("the bucket width must be positive")
+
+    if args.series and numpy is None:
+        parser.error("--series requires numpy")
+
+    if args.jobs < 0:
+        parser.error("the number of jobs can't be negative")
+
+    if args.jobs != 1 and "-" in args.files and not args.merge:
+        parser.error("standard input can only be read without -j")
+
+    try:
+        fields = parse_fields(args.field)
+    except CodecError as e:
+        parser.error(str(e))
+
+    # with JSON output, only the statistics go to stdout
+    report = info if args.json else print
+
+    report("GCAPy Stats " + __version__)
+    report("")
 
     processStart = datetime.now()
 
-    stats = []
+    all_stats = None
     okay = []
     failed = []
     cacheHits = 0
+    mergedOptions = set()
+
+    options = ";".join(["bucket=%g" % args.bucket] + sorted(args.field))
+
+    if args.cache and not args.merge:
+        if os.path.exists(args.cache) and not os.path.isdir(args.cache):
+            parser.error("the cache %s is not a directory (shelve caches are no longer read)" % args.cache)
 
-    gcap = None
-    cache = None
+        if not os.path.isdir(args.cache):
+            os.makedirs(args.cache)
 
-    if args.cache:
         info("Using cache %s" % args.cache)
-        cache = shelve.open(args.cache)
 
-    for i,f in enumerate(args.files):
+    # workers only report back when a capture is done
+    pool = None
+    results = args.files
+
+    if args.jobs != 1 and not args.merge:
+        jobs = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(min(jobs, len(args.files)))
+        results = pool.imap_unordered(gather_job,
+                [(f, args.cache, options, args.bucket, args.field) for f in args.files])
+
+    for i,result in enumerate(results):
         sys.stderr.write("(%d/%d) " % (i+1, len(args.files)))
+        f = result if pool is None else result[0]
 
         try:
-            gcap = GCAP.load(f)
-            meta = gcap.get_metadata()
-            key = binascii.hexlify(meta['record']['guid']) if sys.version_info[0] < 3 else meta['record']['guid'].hex()
+            if pool is not None:
+                f, source, statsDict, cached, msg = result
 
-            if cache is not None:
-                if cache.has_key(key):
-                    info("Loaded '%s' from the cache" % f)
-                    cacheHits += 1
-
-                    stats += [cache[key]]
-                    okay += [[f, meta]]
-                    gcap.close()
+                if msg is not None:
+                    error(msg)
+                    failed += [[f, msg]]
                     continue
 
-            fStats = process(f, gcap, Stats())
+                info("%s '%s'" % ("Loaded from the cache" if cached else "Processed", f))
+                fStats = Stats.from_dict(statsDict)
+                sources = [source]
 
-            if cache is not None:
-                cache[key] = fStats
-                cache.sync()
+                if cached:
+                    cacheHits += 1
+            elif args.merge:
+                info("Merging '%s'" % f)
+                fStats, header = load_stats(f)
+                sources = header["sources"]
+                mergedOptions.add(header["options"])
+                seen = set(o["fingerprint"] for o in okay)
+
+                for source in sources:
+                    if source["fingerprint"] in seen:
+                        raise StatsFormatError("%s already holds the statistics of %s" % (f, source["path"]))
+            else:
+                source, fStats, cached = gather(f, args.cache, options, args.bucket, fields)
+                sources = [source]
+
+                if cached:
+                    cacheHits += 1
 
-            stats += [fStats]
-            okay += [[f, meta]]
-        except IOError:
-            msg = "could not open %s for reading" % f
-            error(msg)
-            failed += [[f, msg]]
-        except GCAPFormatError as e:
-            msg = "GCAP format error: " + str(e)
-            error(msg)
-            failed += [[f, msg]]
-        except GCAPVersionError as e:
-            msg = "GCAP version error: " + str(e)
+            if fStats.throughput is None and numpy is not None:
+                info("'%s' has no throughput statistics, so the combined statistics have none" % f)
+
+            if all_stats is None:
+                all_stats = fStats
+            else:
+                all_stats += fStats
+
+            okay += sources
+        except CAPTURE_ERRORS as e:
+            msg = describe_error(f, e)
             error(msg)
             failed += [[f, msg]]
-        finally:
-            if gcap:
-                gcap.close()
 
-    if cache is not None:
-        cache.close()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+        # list the captures in the order given
+        order = dict((f, i) for i, f in enumerate(args.files))
+        okay.sort(key=lambda o: order[o["path"]])
+        failed.sort(key=lambda x: order[x[0]])
 
     processEnd = datetime.now()
 
-    print("Started: " + str(processStart))
-    print("Ended:   " + str(processEnd))
-    print("Time:    " + str(processEnd-processStart))
-    print("")
+    report("Started: " + str(processStart))
+    report("Ended:   " + str(processEnd))
+    report("Time:    " + str(processEnd-processStart))
+    report("")
 
     note = ""
 
-    if cache is not None:
+    if args.cache and not args.merge:
         if cacheHits < len(okay):
             note = " (%d from cache)" % cacheHits
         else:
             note = " (all cached)"
 
-    print("Statistics generated from %d files%s" % (len(okay), note))
+    report("Statistics generated from %d files%s" % (len(okay), note))
 
     for o in okay:
-        print(" - %s (records %d, GUID %s)" % (o[0],
-            o[1]['record']['record_count'],
-            binascii.hexlify(o[1]['record']['guid']) if sys.version_info[0] < 3 else o[1]['record']['guid'].hex()
-            )
-        )
+        report(" - %s (records %d, GUID %s)" % (o["path"], o["record_count"], o["guid"]))
 
     if len(failed):
-        print("")
-        print("There were %d failed files" % len(failed))
+        report("")
+        report("There were %d failed files" % len(failed))
         for f in failed:
-            print(" - %s (%s)" % (f[0], f[1]))
+            report(" - %s (%s)" % (f[0], f[1]))
 
     # everything failed
     if len(okay) == 0:
         return
 
-    print("")
-
-    all_stats = Stats()
-
-    total = 0
-
-    # combine stats
-    for s in stats:
-        total += s.records
-        all_stats += s
-
-    all_stats.pp()
+    report("")
+
+    if args.save:
+        save_stats(args.save, all_stats, okay, " + ".join(sorted(mergedOptions)) if args.merge else options)
+        info("Wrote the statistics to %s" % args.save)
+
+    if args.series and all_stats.throughput is None:
+        error("no throughput statistics to write to %s" % args.series)
+    elif args.series:
+        with open(args.series, 'w') as seriesFile:
+            seriesFile.write("seconds,server_packets_per_sec,server_bytes_per_sec,"
+                    "client_packets_per_sec,client_bytes_per_sec\n")
+
+            for row in all_stats.throughput.series_rows():
+                seriesFile.write("%g,%g,%g,%g,%g\n" % row)
+
+        info("Wrote rates over time to %s" % args.series)
+
+    if args.json:
+        result = all_stats.stats()
+        result["files"] = okay
+        result["failed"] = [{"path" : f[0], "error" : f[1]} for f in failed]
+
+        print(json.dumps(result))
+    else:
+        all_stats.pp()
+
+def gather(f, cacheDir, options, bucket, fields, progress=True):
+    """
+    Gather the statistics of the capture f, from the stats file cached for
+    it in cacheDir if there is one for the same capture, options and packet
+    tables. Returns (source, stats, cached) where source describes the
+    capture as listed in stats files. progress writes the progress of f to
+    stderr.
+    """
+    gcap = open_capture(f, zero_copy=True)
+
+    try:
+        meta = gcap.get_metadata()['record']
+        source = {
+            "path" : f,
+            "guid" : binascii.hexlify(meta['guid']).decode('ascii'),
+            "record_count" : meta['record_count'],
+            "fingerprint" : binascii.hexlify(meta['sha256_hash']).decode('ascii'),
+        }
+
+        cachePath = None
+
+        if cacheDir is not None:
+            cachePath = os.path.join(cacheDir, "%s-%s.stats" % (source["guid"],
+                hashlib.sha256(options.encode('utf-8')).hexdigest()[:8]))
+
+            if os.path.isfile(cachePath):
+                try:
+                    stats, header = load_stats(cachePath)
+
+                    # statistics gathered without numpy lack throughput
+                    if header["options"] == options and (stats.throughput is None) == (numpy is None) and \
+                            [o["fingerprint"] for o in header["sources"]] == [source["fingerprint"]]:
+                        if progress:
+                            info("Loaded '%s' from the cache" % f)
+
+                        return (source, stats, True)
+                except StatsFormatError as e:
+                    if progress:
+                        info("Ignoring the cached statistics of '%s': %s" % (f, e))
+
+        stats = process(f, gcap, Stats(bucket_width=bucket), fields, progress)
+
+        if cachePath is not None:
+            save_stats(cachePath, stats, [source], options)
+
+        return (source, stats, False)
+    finally:
+        gcap.close()
+
+def gather_job(job):
+    """
+    Run gather in a worker process for the job (f, cacheDir, options,
+    bucket, field names). Returns (f, source, stats as Stats.to_dict,
+    cached, error message) without raising for bad captures.
+    """
+    f, cacheDir, options, bucket, fieldNames = job
+
+    try:
+        source, stats, cached = gather(f, cacheDir, options, bucket, parse_fields(fieldNames), False)
+
+        return (f, source, stats.to_dict(), cached, None)
+    except CAPTURE_ERRORS as e:
+        return (f, None, None, False, describe_error(f, e))
+
+def describe_error(f, e):
+    if isinstance(e, (GCAPFormatError, UnicodeError)):
+        return "GCAP format error: " + str(e)
+    elif isinstance(e, GCAPVersionError):
+        return "GCAP version error: " + str(e)
+    elif isinstance(e, (StatsFormatError, ValueError)):
+        return "stats error: " + str(e)
+    else:
+        return "could not open %s for reading" % f
+
+def parse_fields(names):
+    """
+    Return the PACKET.FIELD names as lists of (name, codec, field) by
+    (PacketType, id). Raises CodecError for unknown packets or fields.
+    """
+    fields = {}
+
+    for name in names:
+        packet, _, field = name.partition(".")
+        codec = get_codec(packet)
+
+        if field not in codec.index:
+            raise CodecError("%s has no field %s (fields: %s)" % (packet, field, ", ".join(codec.names)))
+
+        fields.setdefault((codec.ptype, codec.id), []).append((name, codec, field))
+
+    return fields
+
+def count_fields(stats, fields, data):
+    ptype, pid, unknown, _ = Packet.get_type(data)
+
+    for name, codec, field in fields.get((ptype, pid), []):
+        try:
+            stats.add_field(name, codec.decode(data)[field])
+        except CodecError:
+            stats.add_field(name, "(undecodable)")
 
-def process(f, gcap, stats):
+def process(f, gcap, stats, fields={}, progress=True):
     recordNum = gcap.record_count()
+    write = sys.stderr.write if progress else lambda msg: None
 
     maxProgressLen = len("100%")
     goBack = "\b"*maxProgressLen
     goForward = " "*maxProgressLen
 
-    sys.stderr.write("Processing '%s' %s" % (f, goForward))
-    for i,orec in enumerate(gcap):
-        progress = "%d%%" % (int(float(i+1)/ float(recordNum) * 100))
+    write("Processing '%s' %s" % (f, goForward))
+    lastProgress = ""
+
+    # classify whole captures at once when possible
+    if numpy is not None and hasattr(gcap, 'to_packet_columns'):
+        columns = gcap.to_packet_columns()
+        stats.add_columns(columns)
+
+        for (ptype, pid) in fields:
+            which = (columns['type'] == ptype.value) & (columns['id'] == pid)
 
-        sys.stderr.write(goBack + progress + goForward[len(progress):])
+            for offset, length in zip(columns['offset'][which].tolist(), columns['length'][which].tolist()):
+                count_fields(stats, fields, gcap.mmfile[offset:offset+length])
 
-        rtype = orec['type']
-        record = orec['record']
+        write(goBack + "100%\n")
+        gcap.close()
 
-        if rtype == "GAME":
-            gtype = record['type']
-            record = record['record']
+        return stats
 
-            if gtype == "PACKET":
-                ptype = record['type']
-                dst = record['destination']
-                raw = record['record']
+    # packets of the whole capture for the throughput statistics
+    times = array('q') if numpy is not None else None
+    opcodes = array('h')
+    types = array('b')
+    dsts = array('B')
+    sizes = array('l')
+
+    def add(dst, p):
+        if times is None:
+            stats.add(dst, p)
+            return
+
+        ptype, pid, unknown, _ = Packet.get_type(p)
+
+        times.append(timestamp)
+        opcodes.append(pid)
+        types.append(-1 if ptype is None else ptype.value)
+        dsts.append(dst.value)
+        sizes.append(len(p))
+
+    for number, timestamp, dst, raw in gcap.iter_packets():
+        percent = "%d%%" % (int(float(number+1)/ float(recordNum) * 100))
+
+        if percent != lastProgress:
+            write(goBack + percent + goForward[len(percent):])
+            lastProgress = percent
+
+        # perform packet unrolling
+        if dst == GameRecordDestination.SERVER:
+            unrolledPackets = Packet.unroll(raw)
+
+            for p in unrolledPackets:
+                add(PacketDest.Server, p)
+
+                if fields:
+                    count_fields(stats, fields, p)
+        else:
+            add(PacketDest.Client, raw)
 
-                # perform packet unrolling
-                if dst == "SERVER":
-                    unrolledPackets = Packet.unroll(raw)
+            if fields:
+                count_fields(stats, fields, raw)
 
-                    for p in unrolledPackets:
-                        stats.add(PacketDest.Server, p)
-                else:
-                    stats.add(PacketDest.Client, raw)
+    write("\n")
 
-    sys.stderr.write("\n")
+    if times is not None:
+        stats.add_many(opcodes, types, dsts, sizes)
+        stats.add_times(times, opcodes, types, dsts, sizes)
 
     # free mmfile
     gcap.close()
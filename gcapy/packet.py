@@ -4,6 +4,11 @@ from enum import Enum
 
 from . import packet_names
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class PacketType(Enum):
     Control = 0
     Game = 1
@@ -34,6 +39,17 @@ class Packet:
         else:
             raise RuntimeError("Unsupported packet type: " + str(ptype))
 
+    @staticmethod
+    def get_id_by_name(name):
+        """
+        Return the (PacketType, id) of a packet name. Raises ValueError for
+        unknown names.
+        """
+        if name not in PACKET_IDS_BY_NAME:
+            raise ValueError("unknown packet " + name)
+
+        return PACKET_IDS_BY_NAME[name]
+
     @staticmethod
     def is_unknown(ptype, id):
         if ptype == PacketType.Control:
@@ -68,21 +84,11 @@ class Packet:
             if len(data) == 1:
                 return (None, -1, False, 1)
 
-            byte1 = ord(data[0]) if sys.version_info[1] < 3 else data[1]
-
-            if byte1 >= len(packet_names.control_packet_names):
-                return (None, byte0, False, 2)
-
-            entry = packet_names.control_packet_names[byte1]
+            byte1 = ord(data[1]) if sys.version_info[0] < 3 else data[1]
 
-            return (PacketType.Control, entry[0], entry[2] if len(entry) ==3 else False, 2)
+            return CONTROL_TYPES[byte1]
         else: # game packet
-            if byte0 >= len(packet_names.game_packet_names):
-                return (None, -1, False, 1)
-
-            entry = packet_names.game_packet_names[byte0]
-
-            return (PacketType.Game, entry[0], entry[2] if len(entry) == 3 else False, 1)
+            return GAME_TYPES[byte0]
 
     @staticmethod
     def get_type_with_name(data):
@@ -97,72 +103,299 @@ class Packet:
 
             byte1 = ord(data[1]) if sys.version_info[0] < 3 else data[1]
 
-            if byte1 >= len(packet_names.control_packet_names):
-                return (None, byte0, "", False, 2)
+            return CONTROL_TYPES_WITH_NAME[byte1]
+        else: # game packet
+            return GAME_TYPES_WITH_NAME[byte0]
 
-            entry = packet_names.control_packet_names[byte1]
+    @staticmethod
+    def classify_many(payloads):
+        """
+        Return the get_type result of every packet in payloads, as a list.
+        """
+        if sys.version_info[0] < 3:
+            return [Packet.get_type(data) for data in payloads]
+
+        gameTypes = GAME_TYPES
+        controlTypes = CONTROL_TYPES
+        empty = (None, -1, False, 0)
+        truncated = (None, -1, False, 1)
+        result = []
+        append = result.append
+
+        for data in payloads:
+            if not len(data):
+                append(empty)
+            elif data[0]:
+                append(gameTypes[data[0]])
+            elif len(data) > 1:
+                append(controlTypes[data[1]])
+            else:
+                append(truncated)
 
-            return (PacketType.Control, entry[0], entry[1], entry[2] if len(entry) ==3 else False, 2)
-        else: # game packet
-            if byte0 >= len(packet_names.game_packet_names):
-                return (None, -1, "", False, 1)
+        return result
+
+    @staticmethod
+    def iter_unrolled(data, views=False):
+        """
+        Walk the packets bundled in data, depth first, without copying it.
+        Yields (offset, length) of each container header and packet within
+        data, or memoryviews of them with views.
+        """
+        buf = bytearray(data) if sys.version_info[0] < 3 else data
+        mv = memoryview(data) if views else None
+
+        # packet regions still to visit as (start, end), next on top
+        stack = [(0, len(data))]
+        pop = stack.pop
+
+        while len(stack):
+            start, end = pop()
+
+            # game packets and unknown or plain control packets stand alone
+            if end - start < 2 or buf[start] != 0 or buf[start+1] not in CONTAINER_IDS:
+                yield mv[start:end] if views else (start, end - start)
+                continue
+
+            pid = buf[start+1]
+            headerEnd = start + 2
+            regions = []
+
+            if pid == 0x03: # "MultiPacket"
+                nextByte = headerEnd
+
+                while nextByte < end:
+                    byteCnt = buf[nextByte]
+                    nextByte += 1
+
+                    regions.append((nextByte, min(nextByte+byteCnt, end)))
+                    nextByte += byteCnt
+            elif pid == 0x19: # "MultiPacketEx"
+                nextByte = headerEnd
+
+                while nextByte < end:
+                    count = buf[nextByte]
+                    nextByte += 1
+
+                    # 0xff and 0xffff escape to wider little endian lengths
+                    if count == 0xff:
+                        if nextByte + 2 > end:
+                            break
+
+                        count = struct.unpack("<H", bytes(buf[nextByte:nextByte+2]))[0]
+                        nextByte += 2
 
-            entry = packet_names.game_packet_names[byte0]
+                        if count == 0xffff:
+                            if nextByte + 4 > end:
+                                break
 
-            return (PacketType.Game, entry[0], entry[1], entry[2] if len(entry) == 3 else False, 1)
+                            count = struct.unpack("<I", bytes(buf[nextByte:nextByte+4]))[0]
+                            nextByte += 4
+
+                    regions.append((nextByte, min(nextByte+count, end)))
+                    nextByte += count
+            else: # "SlottedMetaPacket0"
+                headerEnd = min(headerEnd+2, end)
+                regions.append((headerEnd, end))
+
+            yield mv[start:headerEnd] if views else (start, headerEnd - start)
+
+            regions.reverse()
+            stack.extend(regions)
 
     @staticmethod
     def unroll(data):
-        ptype, pid, unknown, nextByte = Packet.get_type(data)
-        headerEnd = nextByte
+        """
+        Return the container headers and packets bundled in data as a list
+        of slices of data, in the order of iter_unrolled.
+        """
+        if len(data) < 2:
+            return [data]
 
-        if ptype != PacketType.Control:
+        byte0 = ord(data[0]) if sys.version_info[0] < 3 else data[0]
+        byte1 = ord(data[1]) if sys.version_info[0] < 3 else data[1]
+
+        # most packets are not containers
+        if byte0 != 0 or byte1 not in CONTAINER_IDS:
             return [data]
 
-        if pid == 0x03: # "MultiPacket"
-            packets = []
-            while nextByte < len(data):
-                byteCnt = struct.unpack("B", data[nextByte])[0] if sys.version_info[0] < 3 else data[nextByte]
-                nextByte += 1
-
-                packets += Packet.unroll(data[nextByte:nextByte+byteCnt])
-                nextByte += byteCnt
-
-            return [data[:headerEnd]] + packets
-        elif pid == 0x25: # "MultiPacketEx"
-            sizes = [8, 16, 32]
-            guards = [0xff, 0xffff]
-            packets = []
-
-            while nextByte < len(data):
-                found = False
-                for i,s in enumerate(sizes):
-                    count = 0
-
-                    if s == 8:
-                        count = struct.unpack("B", data[nextByte])[0] if sys.version_info[0] < 3 else data[nextByte]
-                        nextByte += 1
-                    elif s == 16:
-                        count = struct.unpack("H", data[nextByte:nextByte+2])[0]
-                        nextByte += 2
-                    elif s == 32:
-                        count = struct.unpack("I", data[nextByte:nextByte+4])[0]
-                        nextByte += 4
+        return [data[offset:offset+length] for offset, length in Packet.iter_unrolled(data)]
 
-                    if i == len(guards) or count != guards[i]:
-                        subpacket = data[nextByte:nextByte+count]
-                        packets += Packet.unroll(subpacket)
+    @staticmethod
+    def unroll_columns(data, offsets, lengths, unroll=None):
+        """
+        Unroll many packets of a buffer at once, such as all payloads of a
+        capture (see GCAP.to_columns). data is a NumPy uint8 array, offsets
+        and lengths locate each packet in it and unroll selects the packets
+        to unroll (all by default). Returns NumPy arrays (row, offset,
+        length) of the resulting packets, where row is the input packet
+        each came from. Only containers are unrolled in Python.
+        """
+        if numpy is None:
+            raise ImportError("Packet.unroll_columns requires numpy")
 
-                        nextByte += count
-                        found = True
-                        break
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        lengths = numpy.asarray(lengths, dtype=numpy.int64)
+        rows = numpy.arange(len(offsets), dtype=numpy.int64)
 
-                if not found:
-                    raise RuntimeError("Invalid MultiPacketEx")
+        candidate = lengths >= 2
 
-            return [data[:headerEnd]] + packets
+        if unroll is not None:
+            candidate &= numpy.asarray(unroll, dtype=bool)
 
-        elif pid == 0x09: # "SlottedMetaPacket0"
-            return [data[:headerEnd+2]] +  Packet.unroll(data[headerEnd+2:])
-        else:
-            return [data]
+        containerIds = numpy.array(sorted(CONTAINER_IDS), dtype=numpy.uint8)
+        which = numpy.flatnonzero(candidate)
+        which = which[(data[offsets[which]] == 0) & numpy.isin(data[offsets[which] + 1], containerIds)]
+
+        if len(which) == 0:
+            return (rows, offsets, lengths)
+
+        view = memoryview(data)
+        outRows = []
+        outOffsets = []
+        outLengths = []
+
+        for row in which.tolist():
+            start = int(offsets[row])
+
+            for offset, length in Packet.iter_unrolled(view[start:start+int(lengths[row])]):
+                outRows.append(row)
+                outOffsets.append(start + offset)
+                outLengths.append(length)
+
+        keep = numpy.ones(len(offsets), dtype=bool)
+        keep[which] = False
+
+        rows = numpy.concatenate((rows[keep], numpy.array(outRows, dtype=numpy.int64)))
+        order = numpy.argsort(rows, kind='stable')
+
+        return (rows[order],
+                numpy.concatenate((offsets[keep], numpy.array(outOffsets, dtype=numpy.int64)))[order],
+                numpy.concatenate((lengths[keep], numpy.array(outLengths, dtype=numpy.int64)))[order])
+
+    @staticmethod
+    def classify_columns(data, offsets, lengths):
+        """
+        Classify many packets of a NumPy uint8 buffer at once, like get_type.
+        Returns NumPy arrays (type, id, unknown) where type is a PacketType
+        value, or -1 along with an id of -1 for invalid packets.
+        """
+        if numpy is None:
+            raise ImportError("Packet.classify_columns requires numpy")
+
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        lengths = numpy.asarray(lengths, dtype=numpy.int64)
+
+        # game opcodes are byte 0, control opcodes 256 + byte 1
+        code = numpy.full(len(offsets), INVALID_CODE, dtype=numpy.int64)
+
+        nonEmpty = numpy.flatnonzero(lengths > 0)
+        byte0 = data[offsets[nonEmpty]]
+        code[nonEmpty] = byte0
+
+        control = nonEmpty[(byte0 == 0) & (lengths[nonEmpty] >= 2)]
+        code[control] = 256 + data[offsets[control] + 1].astype(numpy.int64)
+
+        truncated = nonEmpty[(byte0 == 0) & (lengths[nonEmpty] < 2)]
+        code[truncated] = INVALID_CODE
+
+        return (CODE_TYPES[code], CODE_IDS[code], CODE_UNKNOWN[code])
+
+class PacketFilter(object):
+    """
+    Matches packet records by destination and by the names of the packets
+    they carry, looking into bundled packets. Either may be None to match
+    anything. Only the payload bytes are examined.
+    """
+    def __init__(self, names=None, destination=None):
+        self.destination = None if destination is None else int(destination)
+        self.names = None
+        self.game = [False]*256
+        self.control = [False]*256
+
+        if names is not None:
+            self.names = list(names)
+
+            for name in self.names:
+                ptype, pid = Packet.get_id_by_name(name)
+                (self.game if ptype == PacketType.Game else self.control)[pid] = True
+
+    def matches(self, destination, payload):
+        if self.destination is not None and destination != self.destination:
+            return False
+
+        if self.names is None:
+            return True
+
+        if len(payload) == 0:
+            return False
+
+        byte0 = ord(payload[0]) if sys.version_info[0] < 3 else payload[0]
+
+        if byte0 != 0:
+            return self.game[byte0]
+
+        if len(payload) < 2:
+            return False
+
+        byte1 = ord(payload[1]) if sys.version_info[0] < 3 else payload[1]
+
+        if self.control[byte1]:
+            return True
+
+        if byte1 not in CONTAINER_IDS:
+            return False
+
+        for p in Packet.iter_unrolled(payload, True):
+            ptype, pid, unknown, _ = Packet.get_type(p)
+
+            if ptype == PacketType.Game and self.game[pid]:
+                return True
+            elif ptype == PacketType.Control and self.control[pid]:
+                return True
+
+        return False
+
+def _build_type_tables(ptype, names, headerLen, invalid):
+    """
+    Build the get_type and get_type_with_name results for all 256 opcodes.
+    """
+    types = [(None, invalid, False, headerLen)]*256
+    typesWithName = [(None, invalid, "", False, headerLen)]*256
+
+    for entry in names:
+        unknown = entry[2] if len(entry) == 3 else False
+
+        types[entry[0]] = (ptype, entry[0], unknown, headerLen)
+        typesWithName[entry[0]] = (ptype, entry[0], entry[1], unknown, headerLen)
+
+    return (types, typesWithName)
+
+# opcode byte lookups for Packet.get_type and Packet.get_type_with_name
+GAME_TYPES, GAME_TYPES_WITH_NAME = _build_type_tables(PacketType.Game,
+        packet_names.game_packet_names, 1, -1)
+CONTROL_TYPES, CONTROL_TYPES_WITH_NAME = _build_type_tables(PacketType.Control,
+        packet_names.control_packet_names, 2, 0)
+
+# packet names to (PacketType, id) for Packet.get_id_by_name
+PACKET_IDS_BY_NAME = dict([(e[1], (PacketType.Game, e[0])) for e in packet_names.game_packet_names] +
+        [(e[1], (PacketType.Control, e[0])) for e in packet_names.control_packet_names])
+
+# control packets that bundle other packets: MultiPacket, SlottedMetaPacket0
+# and MultiPacketEx
+CONTAINER_IDS = frozenset((0x03, 0x09, 0x19))
+
+def _build_code_tables():
+    """
+    Build NumPy lookups from opcode codes (see Packet.classify_columns) to
+    type, id and unknown.
+    """
+    entries = GAME_TYPES + CONTROL_TYPES + [(None, -1, False, 0)]
+
+    return (numpy.array([-1 if e[0] is None else e[0].value for e in entries], dtype=numpy.int8),
+            numpy.array([e[1] if e[0] is not None else -1 for e in entries], dtype=numpy.int16),
+            numpy.array([e[2] for e in entries], dtype=bool))
+
+INVALID_CODE = 512
+
+if numpy is not None:
+    CODE_TYPES, CODE_IDS, CODE_UNKNOWN = _build_code_tables()
@@ -1,15 +1,20 @@
 import base64
+import math
 import sys
 from binascii import hexlify
 from enum import Enum
 
 from .util import *
 from .gcap import *
+from .stream import GCAPStream
+from .compress import open_capture, compress_capture
 
 class GCAPyAction(Enum):
     Metadata = 0
     Extract = 1
     Stats = 2
+    Compress = 3
+    Slice = 4
 
 class GCAPyOutput(Enum):
     Ascii = 0
@@ -26,6 +31,10 @@ def pp_task(action, output, files, ranges):
         action_name = "Extracting records from"
     elif action is GCAPyAction.Stats:
         action_name = "Gathering stats for GameRecords in"
+    elif action is GCAPyAction.Compress:
+        action_name = "Compressing"
+    elif action is GCAPyAction.Slice:
+        action_name = "Slicing"
     else:
         raise RuntimeError("unhandled action")
 
@@ -41,7 +50,8 @@ def pp_task(action, output, files, ranges):
     return "%s %s with the ranges %s and outputing in %s" % \
            (action_name, str(files), str(ranges), str(output_name))
 
-def process_gcapy(files, ranges, actions, output):
+def process_gcapy(files, ranges, actions, output, index=False, times=[], codec="zlib", slice_file=None,
+        follow=False, packet_filter=None):
     output_process = None # function reference for the output processor
 
     if output is GCAPyOutput.Ascii:
@@ -58,7 +68,7 @@ def process_gcapy(files, ranges, actions, output):
 
     # fail fast
     for f in files:
-        if not file_exists(f):
+        if f != "-" and not file_exists(f):
             error("missing specfied file " + f)
             return 1
 
@@ -68,7 +78,7 @@ def process_gcapy(files, ranges, actions, output):
         info("File: " + f)
 
         try:
-            gcap = GCAP.load(f)
+            gcap = open_capture(f, index)
         except IOError:
             error("could not open %s for reading" % f)
             return 1
@@ -79,19 +89,94 @@ def process_gcapy(files, ranges, actions, output):
             error("GCAP version error: " + str(e))
             return 1
 
-        for action in actions:
-          if action is GCAPyAction.Metadata:
-              output_process(gcap.get_metadata())
-          elif action is GCAPyAction.Extract:
-              for therange in ranges:
-                  for r in get_gcap_range(gcap, therange):
-                      output_process(r)
-          elif action is GCAPyAction.Stats:
-              pass
+        # only plain captures have a timestamp index and can be compressed
+        if not isinstance(gcap, GCAP):
+            if len(times):
+                error("time windows are only supported for uncompressed capture files")
+                return 1
+
+            if GCAPyAction.Compress in actions or GCAPyAction.Slice in actions or follow:
+                error("%s is not an uncompressed capture file" % f)
+                return 1
+
+        try:
+            for action in actions:
+              if action is GCAPyAction.Metadata:
+                  output_process(gcap.get_metadata())
+              elif action is GCAPyAction.Extract and follow:
+                  follow_gcap(gcap, ranges + get_gcap_time_ranges(gcap, times), output_process, packet_filter)
+              elif action is GCAPyAction.Extract and packet_filter is not None:
+                  for therange in ranges + get_gcap_time_ranges(gcap, times):
+                      for r in get_gcap_matching(gcap, therange, packet_filter):
+                          output_process(r)
+              elif action is GCAPyAction.Extract:
+                  for therange in ranges + get_gcap_time_ranges(gcap, times):
+                      for r in get_gcap_range(gcap, therange):
+                          output_process(r)
+              elif action is GCAPyAction.Stats:
+                  pass
+              elif action is GCAPyAction.Compress:
+                  output_name = f + "z" if f.endswith(".gcap") else f + ".gcapz"
+
+                  compress_capture(f, output_name, codec)
+                  info("Compressed %s to %s" % (f, output_name))
+              elif action is GCAPyAction.Slice:
+                  if len(ranges) + len(times) != 1:
+                      error("slicing needs exactly one record range")
+                      return 1
+
+                  slice_ranges = ranges + get_gcap_time_ranges(gcap, times)
+
+                  if len(slice_ranges):
+                      first = max(slice_ranges[0][0], 1)
+                      last = min(slice_ranges[0][1], gcap.record_count()-1)
+
+                  if not len(slice_ranges) or first > last:
+                      error("no records of %s selected to slice" % f)
+                      return 1
+
+                  gcap.write_slice(slice_file, first, last)
+                  info("Wrote records %d-%d of %s to %s" % (first, last, f, slice_file))
+        except GCAPFormatError as e:
+            error("GCAP format error: " + str(e))
+            return 1
 
     return 0
 
+def follow_gcap(gcap, ranges, output_process, packet_filter=None):
+    # follow from the start of the first range
+    first = max(ranges[0][0], 1) if len(ranges) else 1
+
+    try:
+        for r in gcap.follow(first):
+            if packet_filter is not None and (r.type != RecordType.GAME or
+                    not packet_filter.matches(r.destination, r.payload)):
+                continue
+
+            output_process(r.to_dict())
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+def get_gcap_time_ranges(gcap, times):
+    ranges = []
+
+    for t0, t1 in times:
+        first, end = gcap.find_time_range(t0, None if math.isinf(t1) else t1)
+
+        if first < end:
+            ranges.append((first, end-1))
+
+    return ranges
+
 def get_gcap_range(gcap, therange):
+    # streams only move forward, which sorted ranges allow for
+    if isinstance(gcap, GCAPStream):
+        for r in gcap.get_range(max(therange[0], 1), therange[1]):
+            yield r
+
+        return
+
     max_record = gcap.record_count()
     max_iter = min(therange[1]+1, max_record)
 
@@ -104,6 +189,24 @@ def get_gcap_range(gcap, therange):
 
         yield gcap.get_record(i)
 
+def get_gcap_matching(gcap, therange, packet_filter):
+    first = max(therange[0], 1)
+
+    if isinstance(gcap, GCAP):
+        for r in gcap.iter_matching(packet_filter, first, therange[1]):
+            yield r.to_dict()
+
+        return
+
+    if isinstance(gcap, GCAPStream):
+        records = gcap.iter_records(first, therange[1])
+    else:
+        records = (gcap.read_record(i) for i in range(first, min(therange[1]+1, gcap.record_count())))
+
+    for r in records:
+        if r.type == RecordType.GAME and packet_filter.matches(r.destination, r.payload):
+            yield r.to_dict()
+
 # output processors
 def output_ascii(data):
     template = ""
@@ -158,12 +261,21 @@ Game record %d at %.6fs is from %s to %s with contents %s\
     print(template)
 
 def output_json(data):
+    print(json.dumps(encode_json(data)))
+
+def encode_json(data):
+    """
+    Encode the binary fields of a record or metadata dict in place so it
+    can be serialized as JSON. Returns data.
+    """
     rtype = data['type']
     record = data['record']
 
     if rtype == "METADATA":
-        record['guid'] = hexlify(record['guid']) if sys.version_info[0] < 3 else record['guid'].hex()
-        record['sha256_hash'] = hexlify(record['sha256_hash']) if sys.version_info[0] < 3 else record['sha256_hash'].hex()
+        # metadata from get_metadata carries the header fields too
+        if 'guid' in record:
+            record['guid'] = hexlify(record['guid']) if sys.version_info[0] < 3 else record['guid'].hex()
+            record['sha256_hash'] = hexlify(record['sha256_hash']) if sys.version_info[0] < 3 else record['sha256_hash'].hex()
     elif rtype == "GAME":
         gtype = record['type']
         record = record['record']
@@ -174,7 +286,7 @@ def output_json(data):
         else:
             record = encode_record(record)
 
-    print(json.dumps(data))
+    return data
 
 def output_binary(data):
     rtype = data['type']
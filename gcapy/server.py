@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# gcapy by Chord for PSForever
+# server.py - serves GCAP records over HTTP from warm, indexed captures
+
+import sys
+import os
+import argparse
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qs
+
+from . import __version__
+from .gcap import *
+from .compress import open_capture
+from .process import encode_json
+
+class RequestError(Exception):
+    def __init__(self, status, msg):
+        Exception.__init__(self, msg)
+        self.status = status
+
+STATUS_NAMES = {
+    200 : "OK",
+    400 : "Bad Request",
+    404 : "Not Found",
+    405 : "Method Not Allowed",
+    422 : "Unprocessable Entity",
+    500 : "Internal Server Error",
+}
+
+def info(msg):
+    sys.stderr.write(msg + "\n")
+
+class CaptureCache(object):
+    """
+    Keeps up to size captures open, closing the least recently used one
+    when another is opened. A capture is reopened if its file changed.
+    Captures are used by one thread at a time, see open.
+    """
+    def __init__(self, root, size, index=False):
+        self.root = os.path.realpath(root)
+        self.size = size
+        self.index = index
+        self.captures = OrderedDict() # path -> CachedCapture
+        self.lock = threading.Lock() # guards captures and pathLocks
+        self.pathLocks = {} # path -> [lock, users], for paths in use
+
+    def _resolve(self, name):
+        path = os.path.realpath(os.path.join(self.root, name))
+
+        # never serve files outside of the root
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            raise RequestError(404, "no such capture " + name)
+
+        return path
+
+    def _open(self, path, stamp):
+        with self.lock:
+            entry = self.captures.pop(path, None)
+
+            if entry is not None:
+                if entry.stamp == stamp:
+                    self.captures[path] = entry
+                    entry.users += 1
+                    return entry
+
+                self._discard(entry)
+
+        # opening may scan the capture, so other captures stay usable meanwhile
+        try:
+            gcap = open_capture(path, self.index)
+        except (GCAPFormatError, GCAPVersionError) as e:
+            raise RequestError(422, str(e))
+
+        if not hasattr(gcap, 'get_record') or not hasattr(gcap, 'record_count') \
+                or not hasattr(gcap, 'read_record'):
+            gcap.close()
+            raise RequestError(422, "%s does not support random access" % os.path.basename(path))
+
+        entry = CachedCapture(gcap, stamp)
+
+        with self.lock:
+            while len(self.captures) >= self.size:
+                self._discard(self.captures.popitem(last=False)[1])
+
+            self.captures[path] = entry
+            entry.users += 1
+
+        return entry
+
+    def _discard(self, entry):
+        # with self.lock held. captures in use are closed once released
+        entry.evicted = True
+
+        if entry.users == 0:
+            entry.gcap.close()
+
+    def _release(self, entry):
+        with self.lock:
+            entry.users -= 1
+
+            if entry.evicted and entry.users == 0:
+                entry.gcap.close()
+
+    @contextmanager
+    def open(self, name):
+        """
+        Use the capture name, relative to the root. Each capture is used by
+        one thread at a time; other captures can be opened meanwhile.
+        """
+        path = self._resolve(name)
+        st = os.stat(path)
+
+        with self.lock:
+            pathLock = self.pathLocks.setdefault(path, [threading.Lock(), 0])
+            pathLock[1] += 1
+
+        try:
+            with pathLock[0]:
+                entry = self._open(path, (st.st_size, st.st_mtime))
+
+                try:
+                    yield entry.gcap
+                finally:
+                    self._release(entry)
+        finally:
+            # locks only live while their path is in use
+            with self.lock:
+                pathLock[1] -= 1
+
+                if pathLock[1] == 0:
+                    del self.pathLocks[path]
+
+    def close(self):
+        with self.lock:
+            for entry in self.captures.values():
+                self._discard(entry)
+
+            self.captures.clear()
+
+class CachedCapture(object):
+    __slots__ = ("gcap", "stamp", "users", "evicted")
+
+    def __init__(self, gcap, stamp):
+        self.gcap = gcap
+        self.stamp = stamp
+        self.users = 0
+        self.evicted = False
+
+class RecordServer(object):
+    """
+    A small HTTP/1.1 server answering
+
+      GET /metadata?file=F
+      GET /records?file=F[&start=N][&count=N]
+      GET /records?file=F&t0=SECONDS[&t1=SECONDS][&start=N][&count=N]
+      GET /record?file=F&number=N[&format=raw]
+
+    Record pages hold at most MAX_PAGE records and name the record to
+    continue from in "next". Files are relative to the served root.
+    """
+    MAX_PAGE = 1000
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    @staticmethod
+    def _param(params, name, convert=str, default=None):
+        if name not in params:
+            if default is None:
+                raise RequestError(400, "missing parameter " + name)
+
+            return default
+
+        try:
+            return convert(params[name][-1])
+        except ValueError:
+            raise RequestError(400, "invalid parameter " + name)
+
+    def metadata(self, params):
+        with self.cache.open(self._param(params, "file")) as gcap:
+            return encode_json(gcap.get_metadata())
+
+    def records(self, params):
+        with self.cache.open(self._param(params, "file")) as gcap:
+            return self._records(gcap, params)
+
+    def _records(self, gcap, params):
+        count = min(self._param(params, "count", int, 100), RecordServer.MAX_PAGE)
+        first = 1
+        end = gcap.record_count()
+
+        if "t0" in params:
+            if not hasattr(gcap, 'find_time_range'):
+                raise RequestError(422, "time windows are only supported for uncompressed capture files")
+
+            t1 = self._param(params, "t1", float, -1.0)
+            first, end = gcap.find_time_range(self._param(params, "t0", float), t1 if t1 >= 0 else None)
+
+        start = max(self._param(params, "start", int, first), first, 1)
+        last = min(start + max(count, 0), end)
+
+        return {
+            "records" : [encode_json(gcap.get_record(i)) for i in range(start, last)],
+            "next" : last if last < end else None,
+        }
+
+    def record(self, params):
+        with self.cache.open(self._param(params, "file")) as gcap:
+            return self._record(gcap, params)
+
+    def _record(self, gcap, params):
+        number = self._param(params, "number", int)
+
+        if number < 0 or number >= gcap.record_count():
+            raise RequestError(404, "no such record %d" % number)
+
+        if self._param(params, "format", str, "json") == "raw":
+            rec = gcap.read_record(number)
+
+            if rec.type != RecordType.GAME:
+                raise RequestError(422, "record %d has no payload" % number)
+
+            return bytes(rec.payload)
+
+        return encode_json(gcap.get_record(number))
+
+    def handle(self, method, target):
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        handlers = {
+            "/metadata" : self.metadata,
+            "/records" : self.records,
+            "/record" : self.record,
+        }
+
+        if url.path not in handlers:
+            raise RequestError(404, "no such endpoint " + url.path)
+
+        if method != "GET":
+            raise RequestError(405, "only GET is supported")
+
+        return handlers[url.path](params)
+
+    async def serve_client(self, reader, writer):
+        try:
+            while True:
+                requestLine = await reader.readline()
+
+                if not requestLine:
+                    break
+
+                headers = {}
+
+                while True:
+                    line = await reader.readline()
+
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+
+                    name, _, value = line.decode('latin-1').partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, target, version = requestLine.decode('latin-1').split()
+                except ValueError:
+                    break
+
+                try:
+                    # requests may scan captures, so they run off the event loop
+                    result = await asyncio.get_running_loop().run_in_executor(None, self.handle, method, target)
+                    status = 200
+                except RequestError as e:
+                    result = { "error" : str(e) }
+                    status = e.status
+                except (GCAPFormatError, GCAPVersionError) as e:
+                    result = { "error" : str(e) }
+                    status = 422
+                except Exception as e:
+                    info("error handling %s: %s: %s" % (target, type(e).__name__, e))
+                    result = { "error" : "internal error" }
+                    status = 500
+
+                if isinstance(result, bytes):
+                    body = result
+                    contentType = "application/octet-stream"
+                else:
+                    body = json.dumps(result).encode('utf-8')
+                    contentType = "application/json"
+
+                keepAlive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                writer.write(("HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n" %
+                    (status, STATUS_NAMES[status], contentType, len(body),
+                        "keep-alive" if keepAlive else "close")).encode('latin-1') + body)
+                await writer.drain()
+
+                if not keepAlive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve GCAP records over HTTP')
+    parser.add_argument('root', help='directory holding the captures to serve')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8421, help='port to listen on (default: 8421)')
+    parser.add_argument('--unix', metavar='PATH', help='listen on a Unix socket instead')
+    parser.add_argument('--open', type=int, default=32, metavar='N',
+            help='number of captures kept open (default: 32)')
+    parser.add_argument('--index', action='store_true',
+            help='use sidecar record indexes (file.gcap.idx), creating them if needed')
+    args = parser.parse_args()
+
+    cache = CaptureCache(args.root, max(args.open, 1), args.index)
+    server = RecordServer(cache)
+    loop = asyncio.new_event_loop()
+
+    if args.unix:
+        listener = loop.run_until_complete(asyncio.start_unix_server(server.serve_client, path=args.unix))
+        where = args.unix
+    else:
+        listener = loop.run_until_complete(asyncio.start_server(server.serve_client, args.host, args.port))
+        where = "http://%s:%d" % (args.host, args.port)
+
+    info("GCAPy Server %s serving %s on %s" % (__version__, cache.root, where))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        loop.run_until_complete(listener.wait_closed())
+        loop.close()
+        cache.close()
+
+if __name__ == "__main__":
+    main()
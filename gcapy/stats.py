@@ -1,8 +1,221 @@
+import os
+import sys
+import gzip
+import json
+import hashlib
+from array import array
+
+from . import __version__
 from .packet import Packet,PacketType, PacketDest
+from .gcap import OFFSET_TYPECODE
 from . import packet_names
 
+try:
+    import numpy
+    from .packet import CODE_UNKNOWN
+except ImportError:
+    numpy = None
+
+class Throughput:
+    """
+    Packet and byte rates over time, per packet type, id and destination
+    (indexed like Stats.counts). Packets are counted in buckets of
+    bucket_width seconds from the start of each capture, keeping for each
+    packet the busiest bucket and the inter-arrival times. The rates of
+    each direction are also kept as a series of at most SERIES_LEN
+    buckets, which are widened as needed to cover longer captures.
+    """
+    SERIES_LEN = 1 << 14
+
+    def __init__(self, bucket_width=1.0):
+        if numpy is None:
+            raise ImportError("Throughput requires numpy")
+
+        self.bucket_width = bucket_width
+        self.duration = 0.0 # seconds of capture covered
+
+        self.peak_packets = numpy.zeros(Stats.COUNTS_LEN, dtype=numpy.int64)
+        self.peak_bytes = numpy.zeros(Stats.COUNTS_LEN, dtype=numpy.int64)
+
+        # inter-arrival times in seconds
+        self.gap_count = numpy.zeros(Stats.COUNTS_LEN, dtype=numpy.int64)
+        self.gap_sum = numpy.zeros(Stats.COUNTS_LEN)
+        self.gap_sumsq = numpy.zeros(Stats.COUNTS_LEN)
+
+        # packets and bytes per series bucket, by destination
+        self.series_scale = 1 # series bucket width in buckets
+        self.series = numpy.zeros((Throughput.SERIES_LEN, 2, 2), dtype=numpy.int64)
+
+    def _widen(self):
+        folded = self.series.reshape(-1, 2, 2, 2).sum(axis=1)
+
+        self.series = numpy.zeros_like(self.series)
+        self.series[:len(folded)] = folded
+        self.series_scale *= 2
+
+    def add_capture(self, timestamps, slots, dsts, sizes):
+        """
+        Add the packets of one whole capture, given NumPy arrays of their
+        timestamps (microseconds from the start of the capture), Stats.counts
+        indexes, PacketDest values and sizes.
+        """
+        if len(timestamps) == 0:
+            return
+
+        timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+        slots = numpy.asarray(slots, dtype=numpy.int64)
+        dsts = numpy.asarray(dsts, dtype=numpy.int64)
+        sizes = numpy.asarray(sizes, dtype=numpy.int64)
+
+        width = int(round(self.bucket_width*1e6))
+        buckets = timestamps // width
+        bucketCount = int(buckets.max()) + 1
+
+        self.duration += max(float(timestamps.max())/1e6, self.bucket_width)
+
+        # busiest bucket of each packet, from the packets per (slot, bucket)
+        keys = slots*bucketCount + buckets
+        order = numpy.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+
+        bucketPackets = numpy.diff(numpy.append(starts, len(keys)))
+        bucketBytes = numpy.add.reduceat(sizes[order], starts)
+        bucketSlots = keys[starts] // bucketCount
+
+        numpy.maximum.at(self.peak_packets, bucketSlots, bucketPackets)
+        numpy.maximum.at(self.peak_bytes, bucketSlots, bucketBytes)
+
+        # inter-arrival times between packets of the same slot
+        order = numpy.lexsort((timestamps, slots))
+        sortedSlots = slots[order]
+        same = sortedSlots[1:] == sortedSlots[:-1]
+        gaps = numpy.diff(timestamps[order])[same]/1e6
+        gapSlots = sortedSlots[1:][same]
+
+        self.gap_count += numpy.bincount(gapSlots, minlength=Stats.COUNTS_LEN)
+        self.gap_sum += numpy.bincount(gapSlots, weights=gaps, minlength=Stats.COUNTS_LEN)
+        self.gap_sumsq += numpy.bincount(gapSlots, weights=gaps*gaps, minlength=Stats.COUNTS_LEN)
+
+        while bucketCount > Throughput.SERIES_LEN*self.series_scale:
+            self._widen()
+
+        series = (buckets // self.series_scale)*2 + dsts
+        length = Throughput.SERIES_LEN*2
+
+        self.series[:, :, 0] += numpy.bincount(series, minlength=length).reshape(-1, 2)
+        self.series[:, :, 1] += numpy.bincount(series, weights=sizes, minlength=length).round().astype(numpy.int64).reshape(-1, 2)
+
+    def __add__(self, other):
+        if other.bucket_width != self.bucket_width:
+            raise ValueError("cannot combine throughput with %gs and %gs buckets" %
+                    (self.bucket_width, other.bucket_width))
+
+        self.duration += other.duration
+        self.peak_packets = numpy.maximum(self.peak_packets, other.peak_packets)
+        self.peak_bytes = numpy.maximum(self.peak_bytes, other.peak_bytes)
+        self.gap_count += other.gap_count
+        self.gap_sum += other.gap_sum
+        self.gap_sumsq += other.gap_sumsq
+
+        while self.series_scale < other.series_scale:
+            self._widen()
+
+        theirs = other.series
+        scale = other.series_scale
+
+        while scale < self.series_scale:
+            theirs = numpy.concatenate((theirs.reshape(-1, 2, 2, 2).sum(axis=1), numpy.zeros_like(theirs)[:len(theirs)//2]))
+            scale *= 2
+
+        self.series += theirs
+
+        return self
+
+    def rates(self, slot, packets, size):
+        """
+        Return the mean and peak packet and byte rates per second and the
+        mean and standard deviation of inter-arrival times of a slot, given
+        its packet and byte totals.
+        """
+        duration = max(self.duration, self.bucket_width)
+        gapMean = gapDev = None
+
+        if self.gap_count[slot] > 0:
+            gapMean = self.gap_sum[slot]/self.gap_count[slot]
+            gapDev = max(self.gap_sumsq[slot]/self.gap_count[slot] - gapMean*gapMean, 0.0)**0.5
+
+        return {
+            "packets_per_sec" : packets/duration,
+            "peak_packets_per_sec" : self.peak_packets[slot]/self.bucket_width,
+            "bytes_per_sec" : size/duration,
+            "peak_bytes_per_sec" : self.peak_bytes[slot]/self.bucket_width,
+            "interarrival_mean" : gapMean,
+            "interarrival_stddev" : gapDev,
+        }
+
+    def series_rows(self):
+        """
+        Yield (seconds, server packets/s, server bytes/s, client packets/s,
+        client bytes/s) for every series bucket up to the last busy one.
+        """
+        width = self.bucket_width*self.series_scale
+        busy = numpy.flatnonzero(self.series.reshape(len(self.series), -1).any(axis=1))
+        end = int(busy[-1]) + 1 if len(busy) else 0
+
+        for i in range(end):
+            server, client = self.series[i].tolist()
+
+            yield (i*width, server[0]/width, server[1]/width, client[0]/width, client[1]/width)
+
+    def to_dict(self):
+        return {
+            "bucket_width" : self.bucket_width,
+            "duration" : self.duration,
+            "peak_packets" : _sparse(self.peak_packets),
+            "peak_bytes" : _sparse(self.peak_bytes),
+            "gap_count" : _sparse(self.gap_count),
+            "gap_sum" : _sparse(self.gap_sum),
+            "gap_sumsq" : _sparse(self.gap_sumsq),
+            "series_scale" : self.series_scale,
+            "series" : _sparse(self.series.ravel()),
+        }
+
+    @staticmethod
+    def from_dict(d):
+        t = Throughput(d["bucket_width"])
+        t.duration = d["duration"]
+        t.series_scale = d["series_scale"]
+
+        for name in ("peak_packets", "peak_bytes", "gap_count"):
+            setattr(t, name, numpy.array(_dense(d[name], Stats.COUNTS_LEN), dtype=numpy.int64))
+
+        for name in ("gap_sum", "gap_sumsq"):
+            setattr(t, name, numpy.array(_dense(d[name], Stats.COUNTS_LEN), dtype=numpy.float64))
+
+        t.series = numpy.array(_dense(d["series"], t.series.size), dtype=numpy.int64).reshape(t.series.shape)
+
+        return t
+
 class Stats:
-    def __init__(self, verbose=False):
+    # field values shown per field by pp
+    TOP_FIELD_VALUES = 20
+
+    # packet counts are kept per packet type, id and destination, flattened
+    # into a single array at ((type*256) + id)*2 + destination
+    COUNTS_LEN = 2*256*2
+
+    # packet size histograms have exact buckets below SMALL_SIZES, then
+    # SUB_BUCKETS buckets per power of two. The last bucket holds any
+    # larger size
+    SMALL_SIZES = 8
+    SUB_BUCKETS = 4
+    SIZE_BUCKETS = SMALL_SIZES + 14*SUB_BUCKETS
+
+    # size quantiles shown by pp and stats
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, verbose=False, bucket_width=1.0):
         self.verbose = verbose
 
         self.records = 0
@@ -10,15 +223,110 @@ class Stats:
         self.game = 0
         self.invalid = 0
         self.unknown = 0
-        self.game_types = [0]*len(packet_names.game_packet_names)
-        self.control_types = [0]*len(packet_names.control_packet_names)
 
         # network stats
         self.to_client = 0
         self.to_server = 0
         self.size_accum = 0
-        self.game_dst = [[0,0] for i in range(len(packet_names.game_packet_names))]
-        self.control_dst = [[0,0] for i in range(len(packet_names.control_packet_names))]
+        self.counts = Stats._new_counts()
+
+        # bytes and size histogram per packet type, id and destination, at
+        # the counts index (times SIZE_BUCKETS for the histogram)
+        self.bytes = Stats._new_counts()
+        self.sizes = Stats._new_counts(Stats.SIZE_BUCKETS)
+
+        # rates over time, see add_times
+        self.throughput = Throughput(bucket_width) if numpy is not None else None
+
+        # decoded field value counts, by "Packet.field"
+        self.fields = {}
+
+    @staticmethod
+    def _new_counts(width=1):
+        if numpy is not None:
+            return numpy.zeros(Stats.COUNTS_LEN*width, dtype=numpy.int64)
+        else:
+            return array(OFFSET_TYPECODE, [0])*(Stats.COUNTS_LEN*width)
+
+    @staticmethod
+    def _merge_counts(mine, theirs):
+        if numpy is not None:
+            mine = numpy.asarray(mine, dtype=numpy.int64)
+            mine += numpy.asarray(theirs, dtype=numpy.int64)
+        else:
+            for i, v in enumerate(theirs):
+                mine[i] += v
+
+        return mine
+
+    @staticmethod
+    def size_bucket(size):
+        """
+        Return the size histogram bucket of a packet size.
+        """
+        if size < Stats.SMALL_SIZES:
+            return size
+
+        exponent = size.bit_length() - 1
+        sub = (size >> (exponent - 2)) & (Stats.SUB_BUCKETS - 1)
+        bucket = Stats.SMALL_SIZES + (exponent - 3)*Stats.SUB_BUCKETS + sub
+
+        return min(bucket, Stats.SIZE_BUCKETS - 1)
+
+    @staticmethod
+    def size_buckets(sizes):
+        """
+        size_bucket for a NumPy array of sizes.
+        """
+        sizes = numpy.asarray(sizes, dtype=numpy.int64)
+        exponent = numpy.floor(numpy.log2(numpy.maximum(sizes, 1))).astype(numpy.int64)
+        sub = (sizes >> numpy.maximum(exponent - 2, 0)) & (Stats.SUB_BUCKETS - 1)
+        buckets = Stats.SMALL_SIZES + (exponent - 3)*Stats.SUB_BUCKETS + sub
+
+        return numpy.minimum(numpy.where(sizes < Stats.SMALL_SIZES, sizes, buckets), Stats.SIZE_BUCKETS - 1)
+
+    @staticmethod
+    def bucket_bounds(bucket):
+        """
+        Return the smallest and largest size in a size histogram bucket.
+        """
+        if bucket < Stats.SMALL_SIZES:
+            return (bucket, bucket)
+
+        exponent = 3 + (bucket - Stats.SMALL_SIZES)//Stats.SUB_BUCKETS
+        sub = (bucket - Stats.SMALL_SIZES) % Stats.SUB_BUCKETS
+        low = (Stats.SUB_BUCKETS + sub) << (exponent - 2)
+
+        return (low, low + (1 << (exponent - 2)) - 1)
+
+    def _dst_counts(self, ptype, length):
+        base = ptype.value*256*2
+        counts = self.counts[base:base + length*2]
+
+        if numpy is not None and isinstance(counts, numpy.ndarray):
+            counts = counts.tolist()
+
+        return [[counts[i*2], counts[i*2 + 1]] for i in range(length)]
+
+    @property
+    def game_dst(self):
+        return self._dst_counts(PacketType.Game, len(packet_names.game_packet_names))
+
+    @property
+    def control_dst(self):
+        return self._dst_counts(PacketType.Control, len(packet_names.control_packet_names))
+
+    @property
+    def game_types(self):
+        return [server + client for server, client in self.game_dst]
+
+    @property
+    def control_types(self):
+        return [server + client for server, client in self.control_dst]
+
+    def add_field(self, name, value):
+        counts = self.fields.setdefault(name, {})
+        counts[value] = counts.get(value, 0) + 1
 
     def add(self, dst, data):
         ptype, pid, unknown, _ = Packet.get_type(data)
@@ -32,14 +340,8 @@ class Stats:
 
         if ptype == PacketType.Control:
             self.control += 1
-            self.control_types[pid] += 1
-
-            self.control_dst[pid][dst.value] += 1
         elif ptype == PacketType.Game:
             self.game += 1
-            self.game_types[pid] += 1
-
-            self.game_dst[pid][dst.value] += 1
         else:
             raise RuntimeError("Unsupported packet type: " + str(ptype))
 
@@ -50,36 +352,249 @@ class Stats:
         else:
             raise RuntimeError("Unsupported packet destination: " + str(dst))
 
+        slot = (ptype.value*256 + pid)*2 + dst.value
+
+        self.counts[slot] += 1
+        self.bytes[slot] += len(data)
+        self.sizes[slot*Stats.SIZE_BUCKETS + Stats.size_bucket(len(data))] += 1
+
         if unknown:
             self.unknown += 1
 
+    def add_many(self, opcodes, types, dsts, sizes):
+        """
+        Add many packets at once from NumPy arrays of their ids, PacketType
+        values (-1 for invalid packets), PacketDest values and sizes, as
+        from Packet.classify_columns.
+        """
+        if numpy is None:
+            raise ImportError("Stats.add_many requires numpy")
+
+        types = numpy.asarray(types)
+        valid = types >= 0
+
+        self.invalid += int(len(types) - numpy.count_nonzero(valid))
+
+        types = types[valid].astype(numpy.int64)
+        opcodes = numpy.asarray(opcodes)[valid].astype(numpy.int64)
+        dsts = numpy.asarray(dsts)[valid].astype(numpy.int64)
+
+        sizes = numpy.asarray(sizes)[valid].astype(numpy.int64)
+        slots = (types*256 + opcodes)*2 + dsts
+
+        counts = numpy.bincount(slots, minlength=Stats.COUNTS_LEN)
+        self.counts = Stats._merge_counts(self.counts, counts)
+        self.bytes = Stats._merge_counts(self.bytes,
+                numpy.bincount(slots, weights=sizes, minlength=Stats.COUNTS_LEN).round().astype(numpy.int64))
+        self.sizes = Stats._merge_counts(self.sizes,
+                numpy.bincount(slots*Stats.SIZE_BUCKETS + Stats.size_buckets(sizes),
+                    minlength=Stats.COUNTS_LEN*Stats.SIZE_BUCKETS))
+
+        self.records += len(types)
+        self.size_accum += int(sizes.sum())
+        # opcode codes of Packet.classify_columns put control ids after game ids
+        codes = numpy.where(types == PacketType.Game.value, opcodes, 256 + opcodes)
+        self.unknown += int(numpy.count_nonzero(CODE_UNKNOWN[codes]))
+
+        perType = counts.reshape(2, -1).sum(axis=1)
+        self.control += int(perType[PacketType.Control.value])
+        self.game += int(perType[PacketType.Game.value])
+
+        perDst = counts.reshape(-1, 2).sum(axis=0)
+        self.to_server += int(perDst[PacketDest.Server.value])
+        self.to_client += int(perDst[PacketDest.Client.value])
+
+    def add_times(self, timestamps, opcodes, types, dsts, sizes):
+        """
+        Add the timing of all packets of one capture to the throughput
+        statistics, from NumPy arrays like add_many along with timestamps
+        in microseconds from the start of the capture.
+        """
+        if self.throughput is None:
+            raise ImportError("Stats.add_times requires numpy")
+
+        types = numpy.asarray(types)
+        valid = types >= 0
+        slots = (types[valid].astype(numpy.int64)*256 + numpy.asarray(opcodes)[valid])*2 + \
+                numpy.asarray(dsts)[valid]
+
+        self.throughput.add_capture(numpy.asarray(timestamps)[valid], slots,
+                numpy.asarray(dsts)[valid], numpy.asarray(sizes)[valid])
+
+    def add_columns(self, columns):
+        """
+        Add many packets at once from NumPy columns as returned by
+        GCAP.to_packet_columns, which hold all packets of one capture.
+        """
+        self.add_many(columns['id'], columns['type'], columns['destination'], columns['length'])
+        self.add_times(columns['timestamp'], columns['id'], columns['type'], columns['destination'],
+                columns['length'])
+
     # combine two Stats objects
     def __add__(self, other):
+        # refuse before changing anything
+        if self.throughput is not None and other.throughput is not None and \
+                self.throughput.bucket_width != other.throughput.bucket_width:
+            raise ValueError("cannot combine throughput with %gs and %gs buckets" %
+                    (self.throughput.bucket_width, other.throughput.bucket_width))
+
         self.records += other.records
         self.control += other.control
         self.game += other.game
         self.invalid += other.invalid
         self.unknown += other.unknown
 
-        for i,v in enumerate(other.game_types):
-            self.game_types[i] += v
-        for i,v in enumerate(other.control_types):
-            self.control_types[i] += v
-
         # network stats
         self.to_client += other.to_client
         self.to_server += other.to_server
         self.size_accum += other.size_accum
 
-        for i,v in enumerate(other.game_dst):
-            j = self.game_dst[i]
-            self.game_dst[i] = [j[0] + v[0], j[1] + v[1]]
-        for i,v in enumerate(other.control_dst):
-            j = self.control_dst[i]
-            self.control_dst[i] = [j[0] + v[0], j[1] + v[1]]
+        self.counts = Stats._merge_counts(self.counts, other.counts)
+        self.bytes = Stats._merge_counts(self.bytes, other.bytes)
+        self.sizes = Stats._merge_counts(self.sizes, other.sizes)
+
+        # rates need the duration of every capture, so throughput statistics
+        # are dropped when combined with statistics gathered without them
+        if self.throughput is not None and other.throughput is not None:
+            self.throughput += other.throughput
+        else:
+            self.throughput = None
+
+        for name, counts in other.fields.items():
+            mine = self.fields.setdefault(name, {})
+
+            for value, v in counts.items():
+                mine[value] = mine.get(value, 0) + v
 
         return self
 
+    def size_quantile(self, ptype, pid, dst, q):
+        """
+        Estimate the q quantile of the sizes of one packet type and id sent
+        to dst (a PacketDest), from its size histogram. Returns None when no
+        such packets were seen.
+        """
+        slot = (ptype.value*256 + pid)*2 + dst.value
+        histogram = self.sizes[slot*Stats.SIZE_BUCKETS:(slot+1)*Stats.SIZE_BUCKETS]
+
+        if numpy is not None and isinstance(histogram, numpy.ndarray):
+            histogram = histogram.tolist()
+
+        total = sum(histogram)
+
+        if total == 0:
+            return None
+
+        rank = max(q*total, 1)
+        seen = 0
+
+        for bucket, count in enumerate(histogram):
+            if count and seen + count >= rank:
+                low, high = Stats.bucket_bounds(bucket)
+
+                # spread the packets of a bucket evenly over its sizes
+                return low + (high - low)*(rank - seen)/float(count)
+
+            seen += count
+
+        return float(Stats.bucket_bounds(Stats.SIZE_BUCKETS - 1)[1])
+
+    def size_summary(self):
+        """
+        Return the packet count, total bytes and size quantiles of every
+        packet type, id and destination seen, largest byte total first.
+        """
+        summary = []
+        bytesTotal = self.bytes.tolist() if numpy is not None and isinstance(self.bytes, numpy.ndarray) else self.bytes
+        counts = self.counts.tolist() if numpy is not None and isinstance(self.counts, numpy.ndarray) else self.counts
+
+        for ptype in (PacketType.Game, PacketType.Control):
+            for pid in range(len(packet_names.game_packet_names if ptype == PacketType.Game
+                    else packet_names.control_packet_names)):
+                for dst in (PacketDest.Server, PacketDest.Client):
+                    slot = (ptype.value*256 + pid)*2 + dst.value
+
+                    if counts[slot] == 0:
+                        continue
+
+                    summary.append({
+                        "type" : ptype.name,
+                        "id" : pid,
+                        "name" : Packet.get_name_by_id(ptype, pid),
+                        "destination" : dst.name,
+                        "packets" : counts[slot],
+                        "bytes" : bytesTotal[slot],
+                        "quantiles" : dict(("p%g" % (q*100), self.size_quantile(ptype, pid, dst, q))
+                            for q in Stats.QUANTILES),
+                    })
+
+        return sorted(summary, key=lambda x: x["bytes"], reverse=True)
+
+    # the Stats counters kept by to_dict, besides the arrays
+    SCALARS = ("records", "control", "game", "invalid", "unknown", "to_client", "to_server", "size_accum")
+
+    def to_dict(self):
+        """
+        Return the statistics as a JSON serializable dict, with the arrays
+        stored sparsely. See save_stats.
+        """
+        return {
+            "scalars" : dict((name, getattr(self, name)) for name in Stats.SCALARS),
+            "counts" : _sparse(self.counts),
+            "bytes" : _sparse(self.bytes),
+            "sizes" : _sparse(self.sizes),
+            "throughput" : self.throughput.to_dict() if self.throughput is not None else None,
+            "fields" : dict((name, [[value, v] for value, v in counts.items()])
+                for name, counts in self.fields.items()),
+        }
+
+    @staticmethod
+    def from_dict(d):
+        """
+        Rebuild statistics from to_dict. Throughput statistics are dropped
+        without numpy.
+        """
+        stats = Stats()
+
+        for name in Stats.SCALARS:
+            setattr(stats, name, d["scalars"][name])
+
+        stats.counts = Stats._merge_counts(stats.counts, _dense(d["counts"], Stats.COUNTS_LEN))
+        stats.bytes = Stats._merge_counts(stats.bytes, _dense(d["bytes"], Stats.COUNTS_LEN))
+        stats.sizes = Stats._merge_counts(stats.sizes, _dense(d["sizes"], Stats.COUNTS_LEN*Stats.SIZE_BUCKETS))
+        stats.throughput = None
+
+        if numpy is not None and d["throughput"] is not None:
+            stats.throughput = Throughput.from_dict(d["throughput"])
+
+        # JSON turns tuple values into lists
+        stats.fields = dict((name, dict((_tuples(value), v) for value, v in counts))
+                for name, counts in d["fields"].items())
+
+        return stats
+
+    def throughput_summary(self):
+        """
+        Return the packet and byte rates of every packet type, id and
+        destination seen (see Throughput.rates), busiest first, or None
+        without throughput statistics.
+        """
+        if self.throughput is None or self.throughput.duration == 0:
+            return None
+
+        summary = []
+
+        for e in self.size_summary():
+            slot = (PacketType[e["type"]].value*256 + e["id"])*2 + PacketDest[e["destination"]].value
+            entry = dict((k, e[k]) for k in ("type", "id", "name", "destination"))
+            entry.update(self.throughput.rates(slot, e["packets"], e["bytes"]))
+            summary.append(entry)
+
+        return {
+            "duration" : self.throughput.duration,
+            "bucket_width" : self.throughput.bucket_width,
+            "packets" : sorted(summary, key=lambda x: x["packets_per_sec"], reverse=True),
+        }
 
     def stats(self):
         return {
@@ -89,7 +604,12 @@ class Stats:
             "invalid" : self.invalid,
             "unknown" : self.unknown,
             "game_types" : self.game_types,
-            "control_types" : self.control_types
+            "control_types" : self.control_types,
+            "size_accum" : self.size_accum,
+            "sizes" : self.size_summary(),
+            "throughput" : self.throughput_summary(),
+            "fields" : dict((name, sorted(([value, v] for value, v in counts.items()), key=lambda x: x[1], reverse=True))
+                for name, counts in self.fields.items()),
         }
 
     def pp(self):
@@ -224,9 +744,176 @@ Packet Destination
 """ % (len(singleDstGame), fmtlistDest(singleDstGame),
     len(singleDstControl), fmtlistDest(singleDstControl))
 
+        #####################
+
+        fieldValues = []
+
+        for name in sorted(self.fields):
+            counts = sorted(self.fields[name].items(), key=lambda x: x[1], reverse=True)
+            lines = ["%d. %d %s" % (i+1, v, repr(value)) for i, (value, v) in enumerate(counts[:Stats.TOP_FIELD_VALUES])]
+
+            if len(counts) > Stats.TOP_FIELD_VALUES:
+                lines += ["(%d more values)" % (len(counts) - Stats.TOP_FIELD_VALUES)]
+
+            fieldValues += ["== %s (%d values) ==\n%s\n" % (name, len(counts), "\n".join(lines))]
+
+        #####################
+
+        sizeLines = []
+
+        for i, e in enumerate(self.size_summary()):
+            sizeLines += ["%d. %s (0x%02x) -> %s: %d packets, %d bytes, %s" % (i+1, e["name"], e["id"],
+                e["destination"].capitalize(), e["packets"], e["bytes"],
+                " ".join("p%g %.0f" % (q*100, e["quantiles"]["p%g" % (q*100)]) for q in Stats.QUANTILES))]
+
+        sizes = \
+"""\
+Packet sizes (most bytes first)
+
+%s
+""" % "\n".join(sizeLines)
+
+        #####################
+
+        throughput = None
+        summary = self.throughput_summary()
+
+        if summary is not None:
+            def fmtGap(e):
+                if e["interarrival_mean"] is None:
+                    return ""
+
+                return ", inter-arrival %.1fms sd %.1fms" % (e["interarrival_mean"]*1e3, e["interarrival_stddev"]*1e3)
+
+            rateLines = []
+
+            for i, e in enumerate(summary["packets"]):
+                rateLines += ["%d. %s (0x%02x) -> %s: %.2f/s (peak %.0f/s), %.0f B/s (peak %.0f B/s)%s" % (i+1,
+                    e["name"], e["id"], e["destination"].capitalize(), e["packets_per_sec"],
+                    e["peak_packets_per_sec"], e["bytes_per_sec"], e["peak_bytes_per_sec"], fmtGap(e))]
+
+            throughput = \
+"""\
+Throughput over %.0f seconds, peaks per %gs (busiest first)
+
+%s
+""" % (summary["duration"], summary["bucket_width"], "\n".join(rateLines))
+
         #####################
         print(statistics)
         print(frequency)
         print(unseen)
         print(singleDest)
-
+        print(sizes)
+
+        if throughput is not None:
+            print(throughput)
+
+        if len(fieldValues):
+            print("Field values (most frequent first)\n")
+            print("\n".join(fieldValues))
+
+
+def _sparse(values):
+    """
+    Store an array as the indexes and values of its nonzero entries.
+    """
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        index = numpy.flatnonzero(values)
+        return {"length" : len(values), "index" : index.tolist(), "value" : values[index].tolist()}
+
+    index = [i for i, v in enumerate(values) if v]
+
+    return {"length" : len(values), "index" : index, "value" : [values[i] for i in index]}
+
+def _dense(entry, length):
+    if entry["length"] != length or len(entry["index"]) != len(entry["value"]):
+        raise StatsFormatError("array of %d entries, expected %d" % (entry["length"], length))
+
+    values = [0]*length
+
+    for i, v in zip(entry["index"], entry["value"]):
+        values[i] = v
+
+    return values
+
+def _tuples(value):
+    return tuple(_tuples(v) for v in value) if isinstance(value, list) else value
+
+class StatsFormatError(Exception):
+    pass
+
+# stats files are gzip compressed JSON documents
+STATS_FORMAT = "gcapy-stats"
+STATS_VERSION = 1
+
+def opcode_table_version():
+    """
+    Return a digest of the packet name tables. Statistics made with other
+    tables count packets by the same opcodes, but may name and flag them
+    differently.
+    """
+    tables = [[list(e) for e in names] for names in
+            (packet_names.game_packet_names, packet_names.control_packet_names)]
+
+    return hashlib.sha256(json.dumps(tables).encode('utf-8')).hexdigest()[:16]
+
+def save_stats(path, stats, sources, options=""):
+    """
+    Write statistics to a stats file. sources lists a dict for every capture
+    they were gathered from (path, guid, record_count and fingerprint) and
+    options describes how they were gathered, see load_stats. The file is
+    replaced atomically.
+    """
+    doc = {
+        "format" : STATS_FORMAT,
+        "version" : STATS_VERSION,
+        "gcapy" : __version__,
+        "opcodes" : opcode_table_version(),
+        "options" : options,
+        "sources" : sources,
+        "stats" : stats.to_dict(),
+    }
+
+    tmpPath = "%s.tmp%d" % (path, os.getpid())
+
+    with gzip.open(tmpPath, 'wb') as fp:
+        fp.write(json.dumps(doc, separators=(',', ':')).encode('utf-8'))
+
+    if sys.version_info[0] < 3 and os.path.exists(path):
+        os.remove(path)
+
+    os.rename(tmpPath, path)
+
+def load_stats(path, opcodes=True):
+    """
+    Read a stats file, returning (stats, header) where header holds the
+    document without its statistics. Raises StatsFormatError for files that
+    are not stats files, are of a newer version or, when opcodes is true,
+    were made with other packet name tables.
+    """
+    try:
+        with gzip.open(path, 'rb') as fp:
+            doc = json.loads(fp.read().decode('utf-8'))
+    except (IOError, OSError, ValueError, EOFError) as e:
+        if isinstance(e, (IOError, OSError)) and not os.path.isfile(path):
+            raise
+
+        raise StatsFormatError("%s is not a stats file" % path)
+
+    if not isinstance(doc, dict) or doc.get("format") != STATS_FORMAT:
+        raise StatsFormatError("%s is not a stats file" % path)
+
+    if doc["version"] > STATS_VERSION:
+        raise StatsFormatError("%s has version %d, only up to %d is supported" %
+                (path, doc["version"], STATS_VERSION))
+
+    if opcodes and doc["opcodes"] != opcode_table_version():
+        raise StatsFormatError("%s was made with different packet tables" % path)
+
+    try:
+        stats = Stats.from_dict(doc.pop("stats"))
+    except (KeyError, TypeError) as e:
+        raise StatsFormatError("%s is missing %s" % (path, e))
+
+    return (stats, doc)
@@ -0,0 +1,127 @@
+# gcapy by Chord for PSForever
+# stream.py - implements sequential GCAP parsing from any binary stream
+
+import sys
+
+from .gcap import *
+
+class GCAPStream(object):
+    """
+    Reads a GCAP capture front to back from a binary file-like object, such
+    as a pipe or a member of a tar archive. Only one record is held in
+    memory at a time, so records can only be visited in increasing order.
+    """
+    SKIP_CHUNK = 1 << 16
+
+    @staticmethod
+    def open(filename):
+        """
+        Open a capture for streaming. "-" reads from standard input.
+        """
+        if filename == "-":
+            return GCAPStream(sys.stdin.buffer if sys.version_info[0] >= 3 else sys.stdin)
+        else:
+            stream = GCAPStream(open(filename, 'rb'))
+            stream.owned = True
+
+            return stream
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.owned = False # close fp along with the stream
+        self.position = 0 # number of the next record in the stream
+
+        self.header = GCAP._check_header(self._read_exact(GCAP.HEADER_LEN))
+        self.major = self.header['version_major']
+        self.minor = self.header['version_minor']
+
+        if self.major == 1 and self.minor == 0:
+            pass
+        else:
+            raise GCAPVersionError("unsupported version %d.%d" % (self.major, self.minor))
+
+        # the metadata record is always first. keep it for get_metadata
+        self.metadata = None
+
+        if self.record_count() > 0:
+            self.metadata = self._next_record()
+
+    def _read_exact(self, size):
+        data = self.fp.read(size)
+
+        # pipes may return short reads
+        while len(data) < size:
+            more = self.fp.read(size - len(data))
+
+            if not more:
+                raise GCAPFormatError("truncated capture. expected %d more bytes" % (size - len(data)))
+
+            data += more
+
+        return data
+
+    def _skip(self, size):
+        while size > 0:
+            size -= len(self._read_exact(min(size, GCAPStream.SKIP_CHUNK)))
+
+    def _next_record(self, decode=True):
+        recType, recordSize = RECORD_LINK.unpack(self._read_exact(5))
+        which = self.position
+        self.position += 1
+
+        if not decode:
+            self._skip(recordSize)
+            return None
+
+        # the record is already a private copy, so payloads are sliced from it
+        return GCAP._decode_record(which, recType, self._read_exact(recordSize), False)
+
+    def record_count(self):
+        return self.header['record_count']
+
+    def get_metadata(self):
+        if self.metadata is not None and self.metadata.type == RecordType.METADATA:
+            return GCAP._metadata_dict(self.header, self.metadata)
+        else:
+            raise GCAPFormatError("all GCAP files must have a metadata record as the first record")
+
+    def iter_records(self, first=0, last=None):
+        """
+        Yield records first through last (inclusive) as record objects.
+        Records before the current stream position can no longer be read.
+        """
+        if last is None or last >= self.record_count():
+            last = self.record_count() - 1
+
+        if first < self.position:
+            if first == 0 and self.position == 1 and self.metadata is not None:
+                yield self.metadata
+                first = 1
+            else:
+                raise ValueError("record %d has already been read from the stream" % first)
+
+        while self.position < first:
+            self._next_record(False)
+
+        while self.position <= last:
+            yield self._next_record()
+
+    def iter_packets(self):
+        """
+        Yield (number, timestamp, destination, payload) for every game
+        packet record, like GCAP.iter_packets.
+        """
+        for rec in self.iter_records(1):
+            if rec.type == RecordType.GAME:
+                yield (rec.number, rec.timestamp, rec.destination, rec.payload)
+
+    def get_range(self, first, last=None):
+        for rec in self.iter_records(first, last):
+            yield rec.to_dict()
+
+    def __iter__(self):
+        return self.get_range(0)
+
+    def close(self):
+        if self.owned:
+            self.fp.close()
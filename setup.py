@@ -61,6 +61,7 @@ setup(
     extras_require={
         'dev': ['check-manifest'],
         'test': ['coverage'],
+        'numpy': ['numpy'],
     },
 
     # If there are data files included in your packages that need to be
@@ -79,6 +80,8 @@ setup(
         'console_scripts': [
             'gcapy = gcapy.gcapy:main',
             'gcapy-stats = gcapy.gcapy_stats:main',
+            'gcapy-catalog = gcapy.catalog:main',
+            'gcapy-server = gcapy.server:main',
         ],
     },
 )
@@ -0,0 +1,61 @@
+# gcapy by Chord for PSForever
+# capture.py - writes small synthetic captures for the tests
+
+import struct
+import hashlib
+import random
+
+from gcapy.gcap import GCAP
+
+def var_string(data, stringType=2):
+    if len(data) < 256:
+        return struct.pack("<BB", stringType, len(data)) + data
+    elif len(data) < 65536:
+        return struct.pack("<BH", stringType | (1 << 6), len(data)) + data
+    else:
+        return struct.pack("<BI", stringType | (2 << 6), len(data)) + data
+
+def random_bytes(rng, size):
+    return bytes(bytearray(rng.randint(0, 255) for i in range(size)))
+
+def random_packets(count, seed=1):
+    """
+    Return count (timestamp, destination, payload) of game packets, some of
+    them bundled in MultiPacket and SlottedMetaPacket0 containers.
+    """
+    rng = random.Random(seed)
+    timestamp = 0
+    packets = []
+
+    for i in range(count):
+        timestamp += rng.randint(0, 20000)
+        kind = rng.random()
+
+        if kind < 0.2:
+            subPackets = [bytes(bytearray([rng.randint(1, 120)])) + random_bytes(rng, rng.randint(0, 20))
+                    for j in range(rng.randint(1, 4))]
+            payload = b"\x00\x03" + b"".join(bytes(bytearray([len(p)])) + p for p in subPackets)
+        elif kind < 0.3:
+            payload = b"\x00\x09\x00\x01" + b"\x08" + random_bytes(rng, 10)
+        else:
+            payload = bytes(bytearray([rng.randint(1, 120)])) + random_bytes(rng, rng.randint(0, 40))
+
+        packets.append((timestamp, rng.randint(0, 1), payload))
+
+    return packets
+
+def write_capture(filename, packets, title=b"Test capture", description=b"synthetic", guid=b"g"*16):
+    """
+    Write a capture holding a metadata record and a game packet record for
+    each (timestamp, destination, payload).
+    """
+    header = GCAP.HEADER.pack(b"GCAP", 1, 0, 3, guid, 1000, 1000 + len(packets)//100, len(packets) + 1)
+    meta = var_string(title, 0) + var_string(description, 0)
+
+    with open(filename, 'wb') as fp:
+        fp.write(header + hashlib.sha256(header).digest())
+        fp.write(struct.pack("<BI", 0, len(meta)) + meta)
+
+        for timestamp, destination, payload in packets:
+            body = struct.pack("<BQBB", 1, timestamp, 1, destination) + var_string(payload)
+            fp.write(struct.pack("<BI", 1, len(body)) + body)
@@ -0,0 +1,96 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from gcapy import catalog
+from gcapy.gcap import GCAP
+from gcapy.packet import PacketFilter
+
+from .capture import random_packets, write_capture
+
+NAMES = ["MultiPacket", "SlottedMetaPacket0", "LoginMessage", "PlayerStateMessage", "HitHint", "ChatMsg"]
+
+class PostingsTest(unittest.TestCase):
+    def test_round_trip(self):
+        rng = random.Random(1)
+        numbers = []
+        n = 0
+
+        # deltas from one byte up to five
+        for i in range(2000):
+            n += rng.choice((0, 1, 127, 128, 300, 1 << 14, 1 << 21, 1 << 35)) + 1
+            numbers.append(n)
+
+        self.assertEqual(catalog.decode_postings(catalog.encode_postings(numbers)), numbers)
+        self.assertEqual(catalog.decode_postings(catalog.encode_postings([])), [])
+        self.assertEqual(catalog.encode_postings([0, 1, 129]), b"\x00\x01\x80\x01")
+
+class CatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.captures = os.path.join(self.dir, "captures")
+        os.mkdir(self.captures)
+
+        self.filenames = []
+
+        for seed in (1, 2):
+            filename = os.path.join(self.captures, "test%d.gcap" % seed)
+            write_capture(filename, random_packets(1500, seed), guid=bytes(bytearray([seed]*16)))
+            self.filenames.append(filename)
+
+        self.db = catalog.open_catalog(os.path.join(self.dir, "catalog.db"))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.dir)
+
+    def test_undecodable_metadata(self):
+        write_capture(os.path.join(self.captures, "bad.gcap"), random_packets(10), title=b"\xff\xfe")
+
+        added, removed, failed = catalog.update(self.db, [self.captures])
+
+        self.assertEqual((added, removed, failed), (2, 0, 1))
+        self.assertEqual([c['path'] for c in catalog.query(self.db)], self.filenames)
+
+    def check_find(self):
+        added, removed, failed = catalog.index_packets(self.db, [self.captures])
+        self.assertEqual((added, failed), (2, 0))
+
+        for name in NAMES:
+            expected = []
+
+            for filename in self.filenames:
+                gcap = GCAP.load(filename)
+                records = [r.number for r in gcap.iter_matching(PacketFilter([name]))]
+                gcap.close()
+
+                if len(records):
+                    expected.append((filename, records))
+
+            self.assertEqual(list(catalog.find_packets(self.db, [name])), expected)
+
+        # several names give the union of their records
+        union = dict(catalog.find_packets(self.db, NAMES[:2]))
+
+        for filename in self.filenames:
+            gcap = GCAP.load(filename)
+            self.assertEqual(union[filename], [r.number for r in gcap.iter_matching(PacketFilter(NAMES[:2]))])
+            gcap.close()
+
+    @unittest.skipIf(catalog.numpy is None, "numpy is not installed")
+    def test_find_columns(self):
+        self.check_find()
+
+    def test_find(self):
+        numpy = catalog.numpy
+        catalog.numpy = None
+
+        try:
+            self.check_find()
+        finally:
+            catalog.numpy = numpy
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from gcapy.gcap import GCAP
+from gcapy.packet import Packet
+from gcapy.codec import (BitReader, CodecError, UIntL, QFloat, Optional, String,
+        decode, get_codec, iter_messages)
+
+from .capture import write_capture
+
+HIT_HINT = Packet.get_id_by_name("HitHint")[1]
+CHAT_MSG = Packet.get_id_by_name("ChatMsg")[1]
+
+# HitHint from 0x1234 to 0x0102, little endian
+HIT_HINT_BYTES = bytes(bytearray([HIT_HINT, 0x34, 0x12, 0x02, 0x01]))
+
+# ChatMsg of type 5 to u"hi" saying "abc": wide_contents clear, then the
+# recipient's short length 2 and 7 pad bits, then UTF-16, then "abc"
+CHAT_MSG_BYTES = bytes(bytearray([CHAT_MSG, 0x05, 0x41, 0x00])) + b"h\x00i\x00" + b"\x83abc"
+
+class FieldTest(unittest.TestCase):
+    def test_uintl_partial_byte(self):
+        # 0x2ab as 10 bits: the low byte, then the 2 high bits
+        self.assertEqual(UIntL(10).read(BitReader(b"\xab\x80"), 0, None), (0x2ab, 10))
+
+    def test_uintl_unaligned(self):
+        self.assertEqual(UIntL(16).read(BitReader(b"\x93\x44\x80"), 1, None), (0x8926, 17))
+
+    def test_qfloat(self):
+        value, position = QFloat(0.0, 360.0, 8).read(BitReader(b"\x80"), 0, None)
+        self.assertAlmostEqual(value, 128*360.0/255)
+        self.assertEqual(position, 8)
+
+    def test_optional(self):
+        field = Optional(UIntL(4))
+        self.assertEqual(field.read(BitReader(b"\xd0"), 0, None), (10, 5))
+        self.assertEqual(field.read(BitReader(b"\x50"), 0, None), (None, 1))
+
+    def test_long_string(self):
+        data = b"\x00\x03abc"
+        self.assertEqual(String().read(BitReader(data), 0, None), (u"abc", 40))
+
+    def test_too_short(self):
+        self.assertRaises(CodecError, UIntL(16).read, BitReader(b"\x01"), 0, None)
+
+class MessageTest(unittest.TestCase):
+    def test_hit_hint(self):
+        msg = decode(HIT_HINT_BYTES)
+
+        self.assertEqual(msg.name, "HitHint")
+        self.assertEqual(msg.to_dict(), {"source_guid" : 0x1234, "player_guid" : 0x0102})
+
+    def test_chat_msg(self):
+        msg = get_codec("ChatMsg").decode(CHAT_MSG_BYTES)
+
+        # later fields first, so the positions of earlier ones are found on the way
+        self.assertEqual(msg.contents, u"abc")
+        self.assertEqual(msg["recipient"], u"hi")
+        self.assertEqual(msg.message_type, 5)
+        self.assertEqual(msg.wide_contents, False)
+
+    def test_no_codec(self):
+        self.assertIsNone(decode(b"\x00\x01\x00"))
+        self.assertRaises(CodecError, get_codec, "NoSuchMessage")
+
+    def test_iter_messages(self):
+        directory = tempfile.mkdtemp()
+
+        try:
+            filename = os.path.join(directory, "test.gcap")
+            bundled = b"\x00\x03" + bytes(bytearray([len(HIT_HINT_BYTES)])) + HIT_HINT_BYTES
+            write_capture(filename, [(10, 0, bundled), (20, 1, CHAT_MSG_BYTES), (30, 1, b"\x01\x01")])
+
+            gcap = GCAP.load(filename)
+            found = [(number, timestamp, dst, msg.name) for number, timestamp, dst, msg in iter_messages(gcap)]
+            chats = [msg.contents for number, timestamp, dst, msg in iter_messages(gcap, ["ChatMsg"])]
+            gcap.close()
+
+            self.assertEqual(found, [(1, 10, 0, "HitHint"), (2, 20, 1, "ChatMsg")])
+            self.assertEqual(chats, [u"abc"])
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
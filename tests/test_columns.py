@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from gcapy.gcap import GCAP, RecordType, GameRecordDestination
+from gcapy.packet import Packet
+
+from .capture import random_packets, write_capture
+
+@unittest.skipIf(numpy is None, "requires numpy")
+class ColumnsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.gcap")
+
+        # payloads with two and four byte sizes, and an empty one
+        packets = random_packets(3000)
+        packets[10] = (packets[10][0], 1, b"\x12" + b"x"*300)
+        packets[20] = (packets[20][0], 0, b"\x08" + b"y"*70000)
+        packets[30] = (packets[30][0], 0, b"")
+        write_capture(self.filename, packets)
+
+        self.gcap = GCAP.load(self.filename)
+        self.records = [self.gcap.read_record(i) for i in range(self.gcap.record_count())]
+        self.records = [r for r in self.records if r.type == RecordType.GAME]
+
+    def tearDown(self):
+        self.gcap.close()
+        shutil.rmtree(self.dir)
+
+    def payload(self, offset, length):
+        return bytes(self.gcap.mmfile[int(offset):int(offset)+int(length)])
+
+    def test_columns(self):
+        columns = self.gcap.to_columns()
+
+        self.assertEqual(columns['number'].tolist(), [r.number for r in self.records])
+        self.assertEqual(columns['timestamp'].tolist(), [r.timestamp for r in self.records])
+        self.assertEqual(columns['destination'].tolist(), [r.destination for r in self.records])
+        self.assertEqual(columns['packet_type'].tolist(), [r.packet_type for r in self.records])
+        self.assertEqual([self.payload(o, l) for o, l in zip(columns['payload_offset'], columns['payload_length'])],
+                [bytes(r.payload) for r in self.records])
+        self.assertEqual(columns['opcode'].tolist(),
+                [bytearray(r.payload)[0] if len(r.payload) else -1 for r in self.records])
+
+        # the records match get_record too
+        for number, timestamp in zip(columns['number'][:100], columns['timestamp'][:100]):
+            self.assertEqual(self.gcap.get_record(int(number))['record']['timestamp'], timestamp)
+
+    def test_packet_columns(self):
+        columns = self.gcap.to_packet_columns()
+        expected = []
+
+        for r in self.records:
+            payload = bytes(r.payload)
+            parts = Packet.unroll(payload) if r.destination == GameRecordDestination.SERVER else [payload]
+
+            for p in parts:
+                ptype, pid, unknown, _ = Packet.get_type(p)
+                expected.append((r.number, r.timestamp, r.destination, bytes(p),
+                    -1 if ptype is None else ptype.value, pid if ptype is not None else -1, bool(unknown)))
+
+        packets = list(zip(columns['number'].tolist(), columns['timestamp'].tolist(),
+            columns['destination'].tolist(),
+            [self.payload(o, l) for o, l in zip(columns['offset'], columns['length'])],
+            columns['type'].tolist(), columns['id'].tolist(), [bool(u) for u in columns['unknown']]))
+
+        self.assertEqual(packets, expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from gcapy.gcap import GCAP
+from gcapy.compress import CODECS, GCAPBlockFile, compress_capture, open_capture
+
+from .capture import random_packets, write_capture
+
+class CompressTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.gcap")
+        write_capture(self.filename, random_packets(3000))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        gcap = GCAP.load(self.filename)
+        expected = [gcap.get_record(i) for i in range(gcap.record_count())]
+        gcap.close()
+
+        for codec in CODECS:
+            output = os.path.join(self.dir, "test.%s.gcapz" % codec)
+
+            compress_capture(self.filename, output, codec, block_size=4096)
+            compressed = open_capture(output)
+
+            try:
+                self.assertIsInstance(compressed, GCAPBlockFile)
+                self.assertEqual(compressed.record_count(), len(expected))
+                self.assertEqual(compressed.get_metadata()['record']['title'], "Test capture")
+
+                # backwards, so blocks are decompressed again after leaving the cache
+                for i in reversed(range(len(expected))):
+                    self.assertEqual(compressed.get_record(i), expected[i])
+
+                self.assertEqual([p[3] for p in compressed.iter_packets()],
+                        [bytes(r['record']['record']['record']) for r in expected[1:]])
+            finally:
+                compressed.close()
+
+if __name__ == '__main__':
+    unittest.main()
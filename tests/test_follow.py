@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from gcapy.gcap import GCAP
+
+from .capture import random_packets, write_capture
+
+class FollowTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.gcap")
+
+        # the capture as it ends up, written out in pieces by the tests
+        fullFilename = os.path.join(self.dir, "full.gcap")
+        write_capture(fullFilename, random_packets(300))
+
+        full = GCAP.load(fullFilename)
+        self.records = [full.get_record(i) for i in range(full.record_count())]
+        self.starts = [full._get_record_start(i) - 5 for i in range(full.record_count())]
+        full.close()
+
+        with open(fullFilename, 'rb') as fp:
+            self.data = fp.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, start, end):
+        with open(self.filename, 'ab') as fp:
+            fp.write(self.data[start:end])
+
+    def test_follow(self):
+        self.write(0, self.starts[101])
+        gcap = GCAP.load(self.filename)
+
+        # the rest arrives in pieces, some ending within a record
+        pieces = [self.starts[150], self.starts[151] + 3, self.starts[151] + 20, self.starts[220] + 1, len(self.data)]
+        position = [self.starts[101]]
+
+        def append():
+            self.write(position[0], pieces[0])
+            position[0] = pieces.pop(0)
+
+            if len(pieces):
+                schedule()
+
+        def schedule():
+            timer = threading.Timer(0.05, append)
+            timer.daemon = True
+            timer.start()
+
+        followed = []
+
+        for r in gcap.follow(0, poll_interval=0.01, idle_timeout=0.5):
+            followed.append(r)
+
+            # appending starts once the original records are read
+            if r.number == 100:
+                schedule()
+
+        self.assertEqual([r.number for r in followed], list(range(len(self.records))))
+        self.assertEqual([r.to_dict() for r in followed], self.records)
+        self.assertEqual(gcap.record_count(), len(self.records))
+        self.assertEqual(gcap.header['record_count'], len(self.records))
+
+        gcap.close()
+
+    def test_follow_from(self):
+        self.write(0, len(self.data))
+        gcap = GCAP.load(self.filename)
+
+        followed = [r.to_dict() for r in gcap.follow(250, poll_interval=0.01, idle_timeout=0.05)]
+        self.assertEqual(followed, self.records[250:])
+
+        gcap.close()
+
+if __name__ == '__main__':
+    unittest.main()
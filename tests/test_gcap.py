@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from gcapy.gcap import GCAP, GCAPFormatError, GameRecordType
+from gcapy.packet import PacketFilter
+
+from .capture import random_packets, write_capture
+
+class CryptoRecordTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.gcap")
+        write_capture(self.filename, random_packets(100))
+
+        # turn the last game record into a crypto record
+        gcap = GCAP.load(self.filename)
+        position = gcap._get_record_index(gcap.record_count() - 1)[1]
+        gcap.close()
+
+        with open(self.filename, 'r+b') as fp:
+            fp.seek(position)
+            fp.write(bytearray([GameRecordType.CRYPTO]))
+
+        self.gcap = GCAP.load(self.filename)
+
+    def tearDown(self):
+        self.gcap.close()
+        shutil.rmtree(self.dir)
+
+    def test_read_record(self):
+        with self.assertRaises(GCAPFormatError):
+            self.gcap.read_record(self.gcap.record_count() - 1)
+
+    def test_iter_packets(self):
+        with self.assertRaises(GCAPFormatError):
+            list(self.gcap.iter_packets())
+
+    def test_iter_matching(self):
+        # also when the filter would not decode the record
+        for packet_filter in (PacketFilter(), PacketFilter(["ChatMsg"]), PacketFilter(destination=2)):
+            with self.assertRaises(GCAPFormatError):
+                list(self.gcap.iter_matching(packet_filter))
+
+        # records before it are unaffected
+        self.assertEqual(len(list(self.gcap.iter_matching(PacketFilter(), 1, 99))), 99)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from gcapy import gcapy
+from gcapy.gcap import GCAP
+
+from .capture import random_packets, write_capture
+
+def run(args):
+    """
+    Run the gcapy command line with args and return its (exit code, output).
+    """
+    argv, stdout, stderr = sys.argv, sys.stdout, sys.stderr
+    sys.argv = ["gcapy"] + list(args)
+    sys.stdout = sys.stderr = output = StringIO()
+
+    try:
+        gcapy.main()
+        code = 0
+    except SystemExit as e:
+        code = e.code
+    finally:
+        sys.argv, sys.stdout, sys.stderr = argv, stdout, stderr
+
+    return (code, output.getvalue())
+
+class CommandLineTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.gcap")
+        write_capture(self.filename, random_packets(100))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_unknown_packet(self):
+        code, output = run(["-x", "-p", "NotAPacket", self.filename])
+
+        self.assertEqual(code, 2)
+        self.assertIn("Error: ", output)
+        self.assertIn("NotAPacket", output)
+
+    def test_bad_destination(self):
+        code, output = run(["-x", "--dst", "nowhere", self.filename])
+
+        self.assertEqual(code, 2)
+        self.assertIn("Invalid destination nowhere", output)
+
+class SliceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.gcap")
+        self.sliceFilename = os.path.join(self.dir, "slice.gcap")
+        write_capture(self.filename, random_packets(2000))
+        self.gcap = GCAP.load(self.filename)
+
+    def tearDown(self):
+        self.gcap.close()
+        shutil.rmtree(self.dir)
+
+    def raw_record(self, gcap, which):
+        return bytes(gcap.mmfile[gcap._get_record_start(which) - 5:gcap._get_record_end(which)])
+
+    def test_slice(self):
+        code, output = run(["--slice=" + self.sliceFilename, "-r", "100-1500", self.filename])
+        self.assertEqual(code, 0)
+
+        sliced = GCAP.load(self.sliceFilename)
+        header = sliced.header
+
+        with open(self.sliceFilename, 'rb') as fp:
+            headerBytes = fp.read(GCAP.HEADER_LEN)
+
+        self.assertEqual(headerBytes[-32:], hashlib.sha256(headerBytes[:-32]).digest())
+        self.assertEqual(header['record_count'], 1402)
+        self.assertEqual(sliced.record_count(), 1402)
+        self.assertNotEqual(header['guid'], self.gcap.header['guid'])
+        self.assertEqual(header['start'], self.gcap.header['start'])
+
+        lastTimestamp = self.gcap.get_record(1500)['record']['timestamp']
+        self.assertEqual(header['end'], min(self.gcap.header['end'],
+            self.gcap.header['start'] + (lastTimestamp + 999999) // 1000000))
+
+        self.assertEqual(self.raw_record(sliced, 0), self.raw_record(self.gcap, 0))
+
+        for i in range(1, sliced.record_count()):
+            self.assertEqual(self.raw_record(sliced, i), self.raw_record(self.gcap, 99 + i))
+
+        sliced.close()
+
+    def test_slice_clamped(self):
+        code, output = run(["--slice=" + self.sliceFilename, "-r", "1900-6000", self.filename])
+        self.assertEqual(code, 0)
+
+        sliced = GCAP.load(self.sliceFilename)
+        self.assertEqual(sliced.record_count(), 102)
+        self.assertEqual(self.raw_record(sliced, 101), self.raw_record(self.gcap, 2000))
+        sliced.close()
+
+    def test_empty_slice(self):
+        for selection in (["-r", "5000-6000"], ["-t", "100000-"]):
+            code, output = run(["--slice=" + self.sliceFilename] + selection + [self.filename])
+
+            self.assertEqual(code, 1)
+            self.assertIn("no records", output)
+            self.assertFalse(os.path.exists(self.sliceFilename))
+
+    def test_several_ranges(self):
+        code, output = run(["--slice=" + self.sliceFilename, "-r", "1-10,20-30", self.filename])
+
+        self.assertEqual(code, 1)
+        self.assertIn("exactly one record range", output)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from gcapy.gcap import GCAP
+
+from .capture import random_packets, write_capture
+
+class SidecarIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.gcap")
+        self.indexFilename = self.filename + ".idx"
+        self.packets = random_packets(2000)
+        write_capture(self.filename, self.packets)
+
+        gcap = GCAP.load(self.filename)
+        self.links = [tuple(gcap._get_record_index(i)) for i in range(gcap.record_count())]
+        self.records = [gcap.get_record(i) for i in range(gcap.record_count())]
+        gcap.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, gcap):
+        self.assertIsNotNone(gcap.indexFile)
+        self.assertEqual([tuple(gcap._get_record_index(i)) for i in range(gcap.record_count())], self.links)
+
+        for i in reversed(range(gcap.record_count())):
+            self.assertEqual(gcap.get_record(i), self.records[i])
+
+    def test_round_trip(self):
+        gcap = GCAP.load(self.filename, index=True)
+        self.check(gcap)
+        gcap.close()
+
+        self.assertEqual(os.path.getsize(self.indexFilename),
+                GCAP.INDEX_HEADER_LEN + len(self.links)*GCAP.INDEX_ENTRY_LEN)
+
+        # reopening uses the index as it is
+        with open(self.indexFilename, 'rb') as fp:
+            before = fp.read()
+
+        gcap = GCAP.load(self.filename, index=True)
+        self.check(gcap)
+        gcap.close()
+
+        with open(self.indexFilename, 'rb') as fp:
+            self.assertEqual(fp.read(), before)
+
+    def test_index_path(self):
+        indexFilename = os.path.join(self.dir, "elsewhere.idx")
+        gcap = GCAP.load(self.filename, index=indexFilename)
+        self.check(gcap)
+        gcap.close()
+
+        self.assertTrue(os.path.exists(indexFilename))
+        self.assertFalse(os.path.exists(self.indexFilename))
+
+    def test_stale_index(self):
+        GCAP.load(self.filename, index=True).close()
+
+        # another capture of the same size under the same name
+        self.packets[0] = (self.packets[0][0], self.packets[0][1], b"\x09" + self.packets[0][2][1:])
+        write_capture(self.filename, self.packets, guid=b"h"*16)
+
+        gcap = GCAP.load(self.filename)
+        self.links = [tuple(gcap._get_record_index(i)) for i in range(gcap.record_count())]
+        self.records = [gcap.get_record(i) for i in range(gcap.record_count())]
+        self.assertFalse(gcap.load_index(self.indexFilename))
+        gcap.close()
+
+        gcap = GCAP.load(self.filename, index=True)
+        self.check(gcap)
+        gcap.close()
+
+    def test_truncated_index(self):
+        GCAP.load(self.filename, index=True).close()
+
+        with open(self.indexFilename, 'r+b') as fp:
+            fp.truncate(GCAP.INDEX_HEADER_LEN + 10*GCAP.INDEX_ENTRY_LEN)
+
+        gcap = GCAP.load(self.filename, index=True)
+        self.check(gcap)
+        gcap.close()
+
+    def test_time_range(self):
+        plain = GCAP.load(self.filename)
+        indexed = GCAP.load(self.filename, index=True)
+        last = self.packets[-1][0]/1e6
+
+        for t0, t1 in ((0.0, None), (1.0, 2.5), (last/2, last/2), (last/3, last), (last + 1.0, None)):
+            self.assertEqual(indexed.find_time_range(t0, t1), plain.find_time_range(t0, t1))
+
+            for record in indexed.records_between(t0, t1):
+                timestamp = record["record"]["timestamp"]
+                self.assertTrue(t0*1e6 <= timestamp and (t1 is None or timestamp < t1*1e6))
+
+        plain.close()
+        indexed.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from gcapy.packet import Packet, PacketType, PacketFilter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# MultiPacketEx bundling a ChatMsg and a 300 byte packet, the latter behind
+# a 0xff escaped 16 bit length
+BIG = b"\x08" + b"\x00"*299
+MULTI_PACKET_EX = b"\x00\x19" + b"\x03\x12\x01\x02" + b"\xff" + b"\x2c\x01" + BIG
+
+# MultiPacket bundling a SlottedMetaPacket0 around a game packet
+NESTED = b"\x00\x03" + b"\x06" + b"\x00\x09\x00\x05\x08\x01" + b"\x01\x12"
+
+class UnrollTest(unittest.TestCase):
+    def test_multi_packet_ex(self):
+        self.assertEqual(Packet.unroll(MULTI_PACKET_EX), [b"\x00\x19", b"\x12\x01\x02", BIG])
+
+    def test_nested(self):
+        self.assertEqual(Packet.unroll(NESTED), [b"\x00\x03", b"\x00\x09\x00\x05", b"\x08\x01", b"\x12"])
+
+    def test_truncated_length(self):
+        self.assertEqual(Packet.unroll(b"\x00\x19\xff\x2c"), [b"\x00\x19"])
+
+    def test_plain(self):
+        self.assertEqual(Packet.unroll(b"\x08\x00\x19"), [b"\x08\x00\x19"])
+
+    @unittest.skipIf(numpy is None, "requires numpy")
+    def test_unroll_columns(self):
+        packets = [MULTI_PACKET_EX, NESTED, b"\x08\x01"]
+        data = numpy.frombuffer(b"".join(packets), dtype=numpy.uint8)
+        lengths = [len(p) for p in packets]
+        offsets = numpy.cumsum([0] + lengths[:-1])
+
+        rows, offsets, lengths = Packet.unroll_columns(data, offsets, lengths)
+        expected = [(i, p) for i, packet in enumerate(packets) for p in Packet.unroll(packet)]
+
+        self.assertEqual([(r, data[o:o+l].tobytes()) for r, o, l in zip(rows, offsets, lengths)], expected)
+
+    def test_filter(self):
+        self.assertTrue(PacketFilter(["ChatMsg"]).matches(1, MULTI_PACKET_EX))
+        self.assertFalse(PacketFilter(["ChatMsg"], destination=0).matches(1, MULTI_PACKET_EX))
+        self.assertFalse(PacketFilter(["HitHint"]).matches(1, MULTI_PACKET_EX))
+
+    def test_get_id_by_name(self):
+        self.assertEqual(Packet.get_id_by_name("MultiPacketEx"), (PacketType.Control, 0x19))
+        self.assertEqual(Packet.get_id_by_name("ChatMsg"), (PacketType.Game, 0x12))
+        self.assertRaises(ValueError, Packet.get_id_by_name, "NoSuchMessage")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from gcapy.gcap import GCAP
+from gcapy.process import encode_json
+
+from .capture import random_packets, write_capture
+
+# the server needs Python 3
+if sys.version_info[0] >= 3:
+    from gcapy.server import CaptureCache, RecordServer, RequestError
+
+@unittest.skipIf(sys.version_info[0] < 3, "the server needs Python 3")
+class RecordServerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, "root")
+        os.mkdir(self.root)
+
+        write_capture(os.path.join(self.root, "test.gcap"), random_packets(250))
+        write_capture(os.path.join(self.root, "other.gcap"), random_packets(10, seed=2))
+        write_capture(os.path.join(self.dir, "outside.gcap"), random_packets(10))
+
+        self.cache = CaptureCache(self.root, 1)
+        self.server = RecordServer(self.cache)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.dir)
+
+    def assertStatus(self, status, target, method="GET"):
+        with self.assertRaises(RequestError) as cm:
+            self.server.handle(method, target)
+
+        self.assertEqual(cm.exception.status, status)
+
+    def test_not_found(self):
+        self.assertStatus(404, "/records?file=../outside.gcap")
+        self.assertStatus(404, "/record?file=%s&number=1" % os.path.join(self.dir, "outside.gcap"))
+        self.assertStatus(404, "/metadata?file=missing.gcap")
+        self.assertStatus(404, "/record?file=test.gcap&number=251")
+        self.assertStatus(404, "/record?file=test.gcap&number=-1")
+        self.assertStatus(404, "/nothing?file=test.gcap")
+        self.assertStatus(400, "/record?file=test.gcap&number=one")
+        self.assertStatus(405, "/record?file=test.gcap&number=1", "POST")
+
+    def test_record(self):
+        gcap = GCAP.load(os.path.join(self.root, "test.gcap"))
+
+        self.assertEqual(self.server.handle("GET", "/record?file=test.gcap&number=7"),
+                encode_json(gcap.get_record(7)))
+        self.assertEqual(self.server.handle("GET", "/record?file=test.gcap&number=7&format=raw"),
+                bytes(gcap.read_record(7).payload))
+
+        gcap.close()
+
+    def test_paging(self):
+        gcap = GCAP.load(os.path.join(self.root, "test.gcap"))
+        expected = [encode_json(gcap.get_record(i)) for i in range(1, gcap.record_count())]
+        gcap.close()
+
+        records = []
+        start = 1
+
+        while start is not None:
+            page = self.server.handle("GET", "/records?file=test.gcap&start=%d&count=40" % start)
+            self.assertLessEqual(len(page["records"]), 40)
+
+            # switching captures evicts the other one from the cache of one
+            self.server.handle("GET", "/metadata?file=other.gcap")
+
+            records += page["records"]
+            start = page["next"]
+
+        self.assertEqual(records, expected)
+
+        page = self.server.handle("GET", "/records?file=test.gcap&start=240&count=40")
+        self.assertEqual(len(page["records"]), 11)
+        self.assertIsNone(page["next"])
+
+        # per capture locks are gone once no request uses them
+        self.assertEqual(self.cache.pathLocks, {})
+        self.assertEqual(list(self.cache.captures), [os.path.join(os.path.realpath(self.root), "test.gcap")])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import gzip
+import json
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from gcapy import stats as statsModule
+from gcapy.stats import Stats, StatsFormatError, save_stats, load_stats
+from gcapy import gcapy_stats
+from gcapy.gcapy_stats import gather, parse_fields
+
+from .capture import random_packets, write_capture
+
+class StatsFileTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def gather(self, seed, fields=[]):
+        filename = self.path("capture%d.gcap" % seed)
+        write_capture(filename, random_packets(500, seed), guid=(b"%016d" % seed))
+
+        source, stats, cached = gather(filename, None, "", 1.0, parse_fields(fields), False)
+
+        return (source, stats)
+
+    def test_round_trip(self):
+        source, stats = self.gather(1, ["PlayerStateMessage.pos", "ChatMsg.message_type"])
+        save_stats(self.path("a.stats"), stats, [source], "bucket=1")
+
+        loaded, header = load_stats(self.path("a.stats"))
+
+        self.assertEqual(header["sources"], [source])
+        self.assertEqual(header["options"], "bucket=1")
+        self.assertEqual(loaded.fields, stats.fields)
+
+        # field values are listed in dict order
+        loaded.fields = stats.fields = {}
+        self.assertEqual(loaded.to_dict(), stats.to_dict())
+        self.assertEqual(loaded.stats(), stats.stats())
+
+    def test_merge(self):
+        sourceA, a = self.gather(1)
+        sourceB, b = self.gather(2)
+        save_stats(self.path("a.stats"), a, [sourceA])
+        save_stats(self.path("b.stats"), b, [sourceB])
+
+        combined = Stats.from_dict(a.to_dict())
+        combined += b
+
+        merged = load_stats(self.path("a.stats"))[0]
+        merged += load_stats(self.path("b.stats"))[0]
+
+        self.assertEqual(merged.to_dict(), combined.to_dict())
+        self.assertEqual(merged.records, a.records + b.records)
+
+    def test_merge_without_throughput(self):
+        sourceA, a = self.gather(1)
+        sourceB, b = self.gather(2)
+        b.throughput = None
+
+        for first, second in ((a, b), (b, a)):
+            merged = Stats.from_dict(first.to_dict())
+            merged += second
+
+            self.assertIsNone(merged.throughput)
+            self.assertEqual(merged.records, a.records + b.records)
+
+    def rewrite(self, filename, change):
+        with gzip.open(filename, 'rb') as fp:
+            doc = json.loads(fp.read().decode('utf-8'))
+
+        change(doc)
+
+        with gzip.open(filename, 'wb') as fp:
+            fp.write(json.dumps(doc).encode('utf-8'))
+
+    def test_refused(self):
+        source, stats = self.gather(1)
+        filename = self.path("a.stats")
+
+        save_stats(filename, stats, [source])
+        self.rewrite(filename, lambda doc: doc.update(version=statsModule.STATS_VERSION + 1))
+        self.assertRaises(StatsFormatError, load_stats, filename)
+
+        save_stats(filename, stats, [source])
+        self.rewrite(filename, lambda doc: doc.update(opcodes="0"*16))
+        self.assertRaises(StatsFormatError, load_stats, filename)
+        self.assertEqual(load_stats(filename, opcodes=False)[0].records, stats.records)
+
+        with open(filename, 'wb') as fp:
+            fp.write(b"not a stats file")
+
+        self.assertRaises(StatsFormatError, load_stats, filename)
+
+class ParallelGatherTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.files = []
+
+        for seed in (1, 2, 3):
+            filename = os.path.join(self.dir, "capture%d.gcap" % seed)
+            write_capture(filename, random_packets(800*seed, seed), guid=(b"%016d" % seed))
+            self.files.append(filename)
+
+        # a bad capture between good ones
+        self.files.insert(1, os.path.join(self.dir, "bad.gcap"))
+
+        with open(self.files[1], 'wb') as fp:
+            fp.write(b"not a capture")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def run_stats(self, args):
+        argv, stdout, stderr = sys.argv, sys.stdout, sys.stderr
+        sys.argv = ["gcapy_stats"] + args
+        sys.stdout = sys.stderr = output = StringIO()
+
+        try:
+            gcapy_stats.main()
+        except SystemExit:
+            pass
+        finally:
+            sys.argv, sys.stdout, sys.stderr = argv, stdout, stderr
+
+        return output.getvalue()
+
+    def test_parallel(self):
+        results = []
+
+        for jobs in ("1", "2", "0"):
+            filename = os.path.join(self.dir, "jobs%s.stats" % jobs)
+            output = self.run_stats(["-j", jobs, "--field", "ChatMsg.message_type", "--save", filename] + self.files)
+
+            self.assertIn("bad.gcap", output)
+            results.append(load_stats(filename))
+
+        serial, header = results[0]
+        self.assertEqual([s["path"] for s in header["sources"]], [self.files[0]] + self.files[2:])
+
+        for stats, parallelHeader in results[1:]:
+            self.assertEqual(parallelHeader, header)
+            self.assertEqual(stats.fields, serial.fields)
+
+            # field values are listed in dict order
+            stats.fields = {}
+            self.assertEqual(stats.to_dict(), dict(serial.to_dict(), fields={}))
+            self.assertEqual(stats.stats(), Stats.from_dict(dict(serial.to_dict(), fields={})).stats())
+
+if __name__ == '__main__':
+    unittest.main()
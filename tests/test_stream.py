@@ -0,0 +1,90 @@
+import bz2
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from gcapy.gcap import GCAP, GCAPFormatError
+from gcapy.stream import GCAPStream
+from gcapy.compress import open_capture
+
+from .capture import random_packets, write_capture
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.gcap")
+        write_capture(self.filename, random_packets(2000))
+
+        with open(self.filename, 'rb') as fp:
+            self.data = fp.read()
+
+        gcap = GCAP.load(self.filename)
+        self.metadata = gcap.get_metadata()
+        self.records = [gcap.get_record(i) for i in range(gcap.record_count())]
+        self.packets = [(n, t, d, bytes(p)) for n, t, d, p in gcap.iter_packets()]
+        gcap.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, stream):
+        self.assertEqual(stream.get_metadata(), self.metadata)
+        self.assertEqual(list(stream), self.records)
+        stream.close()
+
+    def test_file_object(self):
+        self.check(GCAPStream(io.BytesIO(self.data)))
+
+    def test_pipe(self):
+        readFd, writeFd = os.pipe()
+
+        # small writes, so reads come back short
+        def write():
+            with os.fdopen(writeFd, 'wb') as fp:
+                for i in range(0, len(self.data), 777):
+                    fp.write(self.data[i:i+777])
+                    fp.flush()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+
+        with os.fdopen(readFd, 'rb') as fp:
+            self.check(GCAPStream(fp))
+
+        writer.join()
+
+    def test_compressed(self):
+        for ext, compressor in ((".gz", gzip.GzipFile), (".bz2", bz2.BZ2File)):
+            filename = self.filename + ext
+
+            with compressor(filename, 'wb') as fp:
+                fp.write(self.data)
+
+            stream = open_capture(filename)
+            self.assertIsInstance(stream, GCAPStream)
+            self.check(stream)
+
+    def test_iter(self):
+        stream = GCAPStream(io.BytesIO(self.data))
+
+        self.assertEqual([r.to_dict() for r in stream.iter_records(100, 120)], self.records[100:121])
+        self.assertEqual(list(stream.get_range(500, 510)), self.records[500:511])
+
+        with self.assertRaises(ValueError):
+            list(stream.iter_records(200))
+
+        stream = GCAPStream(io.BytesIO(self.data))
+        self.assertEqual([(n, t, d, bytes(p)) for n, t, d, p in stream.iter_packets()], self.packets)
+
+    def test_truncated(self):
+        stream = GCAPStream(io.BytesIO(self.data[:-3]))
+
+        with self.assertRaises(GCAPFormatError):
+            list(stream)
+
+if __name__ == '__main__':
+    unittest.main()